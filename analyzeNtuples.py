@@ -55,6 +55,12 @@ def analyzeNtuples(  # noqa: PLR0913
     workers: int = typer.Option(2, '-j', '--jobworkers', help='# of local workers'),
     workdir: str = typer.Option(None, '-w', '--workdir', help='local work directory'),
     submit: bool = typer.Option(False, '-S', '--submit', help='submit the jobs via CONDOR'),
+    read_workers: int = typer.Option(
+        None, '-t', '--read-workers', help='# of threads for decompression and interpretation (-1: # of cores)'
+    ),
+    parallel: int = typer.Option(
+        0, '-P', '--parallel', help='# of local processes the events are split in (merged into a single output file)'
+    ),
 ):
     if submit and local and not workdir:
         raise ValueError('The --workdir option is required when submitting jobs locally')
@@ -86,6 +92,8 @@ def analyzeNtuples(  # noqa: PLR0913
             'WORKERS': workers,
             'WORKDIR': workdir,
             'SUBMIT': submit,
+            'READWORKERS': read_workers,
+            'PARALLEL': parallel,
         }
     )
     collection_params = get_collection_parameters(opt, cfgfile)
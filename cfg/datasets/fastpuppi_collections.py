@@ -2,7 +2,7 @@ import awkward as ak
 import numpy as np
 import math
 
-from python.collections import DFCollection
+from python.collections import DFCollection, get_trackmatched_egs
 from python import pf_regions
 
 def mc_fixtures(particles):
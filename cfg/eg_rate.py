@@ -102,10 +102,7 @@ class RatePlotter(plotters.BasePlotter):
         # print '------------------'
         # print self.tp_set.name
         for selection in self.tp_selections:
-            sel_clusters = self.tp_set.df
-            if not selection.all:
-                # print(selection)
-                sel_clusters = self.tp_set.df[selection.selection(self.tp_set.df)]
+            sel_clusters = self.tp_set.select(selection)
             # max_pt_index = ak.argmax(sel_clusters.pt, axis=1, keepdims=True)
             # max_pt_per_event = sel_clusters[max_pt_index]
             self.h_rate[selection.name].fill(sel_clusters)
@@ -135,7 +132,7 @@ class BaseRateCounter(plotters.BasePlotter):
             # print(self.tp_set.df.pt)
             # print(self.tp_set.df.rho)
 
-            sel_clusters = self.tp_set.df[selection.selection(self.tp_set.df)]
+            sel_clusters = self.tp_set.select(selection)
             # print(sel_clusters)
             self.h_rate[selection.name].fill(sel_clusters)
             self.h_rate[selection.name].fill_norm(self.tp_set.new_read_nentries)
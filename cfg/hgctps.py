@@ -146,9 +146,7 @@ class HGCCl3DRatePlotter(plotters.BasePlotter):
 
     def fill_histos(self, debug=0):
             for selection in self.tp_selections:
-                sel_clusters = self.tp_set.df
-                if not selection.all:
-                    sel_clusters = self.tp_set.df[selection.selection(self.tp_set.df)]
+                sel_clusters = self.tp_set.select(selection)
                 self.h_rate[selection.name].fill(sel_clusters)
                 self.h_rate[selection.name].fill_norm(self.tp_set.new_read_nentries)
 
@@ -117,10 +117,7 @@ class CorrOccupancyPlotter(plotters.BasePlotter):
     def fill_histos(self, debug=0):
         for tp_sel in self.data_selections:
             # print(tp_sel)
-            if tp_sel.all:
-                objects = self.data_set.df
-            else:
-                objects = self.data_set.df[tp_sel.selection(self.data_set.df)]
+            objects = self.data_set.select(tp_sel)
             self.h_occ[tp_sel.name].fill(objects)
 
 
@@ -0,0 +1,69 @@
+import os
+
+import typer
+import uproot as up
+import yaml
+from rich import print as pprint
+
+import python.file_manager as fm
+from python.parquet_tree import convert_tree, write_metadata
+from python.tree_reader import BRANCH_BLACKLIST
+
+description = """
+Convert the input ntuples of a sample to Parquet.
+
+The configured tree (w/o the blacklisted branches) is converted file by file
+into Parquet files with one column per branch and row groups of `read_entry_block` entries.
+A metadata.json file indexing the converted files is written in the output dir:
+pointing the dataset input dir to it, the converted files are read by `analyzeNtuples.py`.
+"""
+
+
+def convertToParquet(
+    datasetfile: str = typer.Option(
+        ..., '-i', '--input-dataset', help='specify the yaml file defining the input dataset'
+    ),
+    sample: str = typer.Option(..., '-s', '--sample', help='specify the sample to be converted'),
+    outdir: str = typer.Option(..., '-o', '--outdir', help='output directory for the Parquet files'),
+    nevents: int = typer.Option(-1, '-n', '--nevents', help='# of events to convert'),
+    read_entry_block: int = typer.Option(10000, '-b', '--block', help='# of entries per row group'),
+    debug: int = typer.Option(0, '-d', '--debug', help='debug level'),
+):
+    with open(datasetfile) as stream:
+        cfgfile = yaml.load(stream, Loader=yaml.FullLoader)
+
+    tree_name = cfgfile['dataset']['tree_name']
+    input_dir = os.path.join(cfgfile['dataset']['input_dir'], cfgfile['samples'][sample]['input_sample_dir'])
+    input_files = fm.get_files_for_processing(
+        input_dir=input_dir,
+        tree=tree_name,
+        nev_toprocess=nevents,
+        debug=debug,
+    )
+    os.makedirs(outdir, exist_ok=True)
+
+    file_metadata = {}
+    nev_sofar = 0
+    for file_name in sorted(input_files):
+        if nevents != -1 and nev_sofar >= nevents:
+            break
+        out_file_name = os.path.join(outdir, os.path.basename(file_name).replace('.root', '.parquet'))
+        pprint(f'converting file: {file_name} -> {out_file_name}')
+        tree_file = up.open(fm.file_name_wprotocol(file_name), num_workers=1)
+        nev = convert_tree(tree=tree_file[tree_name],
+                           tree_name=tree_name,
+                           output_file_name=out_file_name,
+                           row_group_entries=read_entry_block,
+                           branch_blacklist=BRANCH_BLACKLIST,
+                           max_events=-1 if nevents == -1 else nevents - nev_sofar)
+        tree_file.close()
+        if nev > 0:
+            file_metadata[out_file_name] = nev
+        nev_sofar += nev
+
+    write_metadata(outdir, file_metadata)
+    pprint(f'converted {nev_sofar} events in {len(file_metadata)} files to dir: {outdir}')
+
+
+if __name__ == '__main__':
+    typer.run(convertToParquet)
@@ -1,13 +1,18 @@
+import multiprocessing
 import os
 import sys
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 import uproot as up
 from rich import print as pprint
 
+import python.branch_cache as branchcache
 import python.calibrations as calibs
 import python.file_manager as fm
 import python.histos as Histos
+import python.mp_pool as mp_pool
+import python.parquet_tree as parquettree
 import python.tree_reader as treereader
 from python import collections, timecounter
 
@@ -19,10 +24,19 @@ def analyze(params, batch_idx=-1):
     params.print()
     debug = int(params.debug)
 
+    if params.get('backend', 'uproot') == 'dask' and params.get('parallel', 0) > 1:
+        raise ValueError('[analyzer] the parallel shards are not supported by the dask backend: '
+                         'use dask_workers to set the # of processes')
+
     input_files = []
     range_ev = (0, params.maxEvents)
+    shards = None
 
-    if params.events_per_job == -1:
+    if params.events_per_job == -1 and params.get('parallel', 0) > 1:
+        pprint(f'This is interactive processing in {params.parallel} parallel shards...')
+        shards = get_shards(params, params.parallel)
+        input_files = sorted({file_name for files, _, _ in shards for file_name in files})
+    elif params.events_per_job == -1:
         pprint('This is interactive processing...')
         input_files = fm.get_files_for_processing(
             input_dir=os.path.join(params.input_base_dir, params.input_sample_dir),
@@ -53,6 +67,11 @@ def analyze(params, batch_idx=-1):
     if params.rate_pt_wps:
         calib_manager.set_pt_wps_version(params.rate_pt_wps)
 
+    collections.DFCollection.compiled_selections = params.get('compiled_selections', False)
+
+    # the workers are started only if some task is actually run in parallel
+    mp_pool.POOL.configure(n_workers=params.get('pool_workers', 1), kind=params.get('pool_type', 'process'))
+
     output = up.recreate(params.output_filename)
     hm = Histos.HistoManager()
     hm.file = output
@@ -67,6 +86,50 @@ def analyze(params, batch_idx=-1):
         plotter.print()
         plotter.book_histos()
 
+    if params.get('cutflow', False):
+        # booked after the plotters: the collections are activated when booking them
+        cutflow_names = []
+        for collection in collections.EventManager().active_collections:
+            # several collections can share the same name (e.g. GEN): the following ones get an index
+            name = collection.name
+            if name in cutflow_names:
+                name = f'{collection.name}_{cutflow_names.count(collection.name) + 1}'
+            cutflow_names.append(collection.name)
+            collection.cutflow = Histos.CutFlowHistos(name, collection.label)
+
+    column_tracker = None
+    if params.get('column_pruning', None):
+        column_tracker = treereader.ColumnTracker(params.column_pruning, params.get('column_manifest', None))
+
+    if params.get('backend', 'uproot') == 'dask':
+        # optional dependency: imported only when needed
+        import python.dask_backend as daskbackend
+        n_tot_entries = daskbackend.process_dask(params, files_with_protocol, range_ev, params.maxEvents,
+                                                  column_tracker)
+    elif shards is not None:
+        n_tot_entries = process_shards(params, shards, column_tracker)
+    else:
+        n_tot_entries = process_files(params, files_with_protocol, range_ev, params.maxEvents, column_tracker, batch_idx)
+
+    mp_pool.POOL.shutdown()
+
+    pprint(f'Writing histos to file {params.output_filename}')
+    hm.writeHistos()
+    output.close()
+
+    if column_tracker is not None:
+        column_tracker.save()
+
+    return n_tot_entries
+
+
+def process_files(params, input_files, range_ev, max_events, column_tracker=None, batch_idx=-1):
+    """
+    Run the event loop over the input files.
+
+    The histograms of the plotters (booked by the caller) are filled.
+    Returns the # of entries processed.
+    """
     collection_manager = collections.EventManager()
 
     if params.weight_file is not None:
@@ -74,52 +137,206 @@ def analyze(params, batch_idx=-1):
 
     # -------------------------EVENT LOOP--------------------------------
 
-    tree_reader = treereader.TreeReader(range_ev, params.maxEvents)
+    per_event = is_per_event(params)
+    if per_event:
+        pprint('Per-event processing requested: the event loop will run over every entry')
+
+    branch_cache = None
+    if params.get('branch_cache_dir', None):
+        branch_cache = branchcache.BranchCache(params.branch_cache_dir, params.get('branch_cache_max_size', 10000))
+
+    read_workers = params.get('read_workers', 0)
+    if read_workers and read_workers < 0:
+        read_workers = len(os.sched_getaffinity(0))
+    if read_workers:
+        pprint(f'Using {read_workers} threads for decompression and interpretation')
+
+    fill_workers = params.get('fill_workers', 0)
+    if fill_workers and fill_workers < 0:
+        fill_workers = len(os.sched_getaffinity(0))
+    fill_executor = None
+    if fill_workers:
+        pprint(f'Using {fill_workers} threads for filling the plotters')
+        fill_executor = ThreadPoolExecutor(max_workers=fill_workers, thread_name_prefix='fill')
+
+    tree_reader = treereader.TreeReader(range_ev, max_events, column_tracker,
+                                        read_ahead=params.get('read_ahead', 0),
+                                        read_ahead_max_memory=params.get('read_ahead_max_memory', 2000),
+                                        branch_cache=branch_cache)
     pprint('')
     pprint(f"{'events_per_job':<15}: {params.events_per_job}")
-    pprint(f"{'maxEvents':<15}: {params.maxEvents}")
+    pprint(f"{'maxEvents':<15}: {max_events}")
     pprint(f"{'range_ev':<15}: {range_ev}")
     pprint('')
 
-    for tree_file_name in files_with_protocol:
-        tree_file = up.open(tree_file_name, num_workers=1)
+    for tree_file_name in input_files:
+        if tree_reader.finished():
+            pprint(f'no more entries to be processed: skipping file: {tree_file_name}')
+            continue
+        if tree_file_name.endswith('.parquet'):
+            tree_file = parquettree.ParquetFile(tree_file_name)
+        else:
+            # the executors are shut down by uproot when the file is closed
+            decompression_executor = None
+            interpretation_executor = None
+            if read_workers:
+                decompression_executor = ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix='decompression')
+                interpretation_executor = ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix='interpretation')
+            tree_file = up.open(tree_file_name,
+                                num_workers=1,
+                                decompression_executor=decompression_executor,
+                                interpretation_executor=interpretation_executor)
         pprint(f'opening file: {tree_file_name}')
         pprint(f' . tree name: {params.tree_name}')
 
         ttree = tree_file[params.tree_name]
 
-        tree_reader.setTree(ttree)
-
-        while tree_reader.next(debug):
-            try:
-                collection_manager.read(tree_reader, debug)
-
-                for plotter in plotter_collection:
-                    plotter.fill_histos_event(tree_reader.file_entry, debug=debug)
-
-                if (
-                    batch_idx != -1
-                    and timecounter.counter.started()
-                    and tree_reader.global_entry % 100 == 0
-                    and timecounter.counter.job_flavor_time_left(params.htc_jobflavor) < 5 * 60
-                ):
-                    tree_reader.printEntry()
-                    pprint('    less than 5 min left for batch slot: exit event loop!')
-                    timecounter.counter.job_flavor_time_perc(params.htc_jobflavor)
-                    break
-
-            except Exception as inst:
-                tree_reader.printEntry()
-                pprint(f'[EXCEPTION OCCURRED:] {inst!s}')
-                pprint('Unexpected error:', sys.exc_info()[0])
-                traceback.print_exc()
-                tree_file.close()
-                sys.exit(200)
+        try:
+            process_tree(params, tree_reader, ttree, per_event, column_tracker, batch_idx, fill_executor)
+        except Exception as inst:
+            tree_reader.printEntry()
+            pprint(f'[EXCEPTION OCCURRED:] {inst!s}')
+            pprint('Unexpected error:', sys.exc_info()[0])
+            traceback.print_exc()
+            tree_reader.clearReadAhead()
+            tree_file.close()
+            sys.exit(200)
 
+        tree_reader.clearReadAhead()
         tree_file.close()
 
-    pprint(f'Writing histos to file {params.output_filename}')
-    hm.writeHistos()
-    output.close()
+    if fill_executor is not None:
+        fill_executor.shutdown()
 
     return tree_reader.n_tot_entries
+
+
+def is_per_event(params):
+    # the loop runs over the entry blocks unless some plotter (or the debug printout of some collection)
+    # needs to be called for each event
+    collection_manager = collections.EventManager()
+    return (any(plotter.per_event for plotter in params.plotters)
+            or any(coll.debug > 0 for coll in collection_manager.active_collections))
+
+
+def process_tree(params, tree_reader, ttree, per_event, column_tracker=None, batch_idx=-1, fill_executor=None):
+    """
+    Run the event loop over the entries of a tree.
+
+    The loop stops at the end of the tree or when the entries to be processed
+    by the `tree_reader` are exhausted.
+    If a `fill_executor` is given the plotters are filled concurrently, one task per plotter.
+    """
+    debug = int(params.debug)
+    collection_manager = collections.EventManager()
+
+    tree_reader.setTree(ttree)
+    if params.get('read_block_memory', None):
+        collection_manager.set_read_entry_block(tree_reader.estimateBlockSize(params.read_block_memory))
+
+    while tree_reader.next(debug):
+        collection_manager.read(tree_reader, debug)
+
+        if fill_executor is None:
+            for plotter in params.plotters:
+                plotter.fill_histos_event(tree_reader.file_entry, debug=debug)
+        else:
+            # each plotter only fills its own histograms and reads the collections: no histogram is
+            # filled by two threads at the same time
+            list(fill_executor.map(lambda plotter: plotter.fill_histos_event(tree_reader.file_entry, debug=debug),
+                                   params.plotters))
+
+        if column_tracker is not None:
+            # the first block of all the collections has been processed
+            column_tracker.freeze()
+
+        if not per_event:
+            # nothing to be done until the next block is read: skip to its first entry
+            tree_reader.skipTo(collection_manager.next_entry_read())
+
+        if (
+            batch_idx != -1
+            and timecounter.counter.started()
+            and (not per_event or tree_reader.global_entry % 100 == 0)
+            and timecounter.counter.job_flavor_time_left(params.htc_jobflavor) < 5 * 60
+        ):
+            tree_reader.printEntry()
+            pprint('    less than 5 min left for batch slot: exit event loop!')
+            timecounter.counter.job_flavor_time_perc(params.htc_jobflavor)
+            break
+
+
+def get_shards(params, nshards):
+    """
+    Split the events to be processed in `nshards` shards of (about) the same size.
+
+    The files and entry range of each shard are computed by the same logic used for the batch jobs.
+    Returns a list of (files, entry range, max # of events).
+    """
+    debug = int(params.debug)
+    metadata = fm.get_metadata(os.path.join(params.input_base_dir, params.input_sample_dir), params.tree_name, debug)
+    nev_toprocess = sum([int(nevents) for nevents in metadata.values()])
+    if params.maxEvents != -1:
+        nev_toprocess = min([params.maxEvents, nev_toprocess])
+    nev_pershard = -(-nev_toprocess // nshards)
+    if nev_pershard == 0:
+        return []
+    # the last shard gets the remaining events: its range is bound by the max # of events
+    jobs = fm.get_njobs(nev_pershard * nshards, nev_pershard, metadata, debug)
+    shards = []
+    for shard_id, (files, range_ev) in jobs.items():
+        max_events = min([nev_pershard, nev_toprocess - shard_id * nev_pershard])
+        if len(files) == 0 or max_events <= 0:
+            continue
+        shards.append((files, range_ev, max_events))
+    return shards
+
+
+def process_shard(conn, params, shard, column_tracker):
+    # runs in a forked process: the plotters and histograms booked by the parent are inherited
+    hm = Histos.HistoManager()
+    # the tuples are buffered and written by the parent
+    hm.file = None
+    input_files, range_ev, max_events = shard
+    files_with_protocol = [fm.get_eos_protocol(file_name) + file_name for file_name in input_files]
+    n_entries = process_files(params, files_with_protocol, range_ev, max_events, column_tracker)
+    fields = column_tracker.fields if column_tracker is not None else set()
+    conn.send((n_entries, hm.getStates(), fields))
+    conn.close()
+
+
+def process_shards(params, shards, column_tracker=None):
+    """
+    Run the event loop over the shards in parallel, one process per shard.
+
+    The histograms of each shard are merged in memory into the ones booked by the parent.
+    Returns the # of entries processed.
+    """
+    hm = Histos.HistoManager()
+    context = multiprocessing.get_context('fork')
+    workers = []
+    for shard in shards:
+        pprint(f'starting shard #{len(workers)}: files: {shard[0]}, range_ev: {shard[1]}, maxEvents: {shard[2]}')
+        reader, writer = context.Pipe(duplex=False)
+        process = context.Process(target=process_shard, args=(writer, params, shard, column_tracker))
+        process.start()
+        writer.close()
+        workers.append((process, reader))
+
+    n_tot_entries = 0
+    for shard_id, (process, reader) in enumerate(workers):
+        try:
+            n_entries, states, fields = reader.recv()
+        except EOFError:
+            process.join()
+            pprint(f'[EXCEPTION OCCURRED:] shard #{shard_id} failed with exit code: {process.exitcode}')
+            for other_process, _ in workers:
+                other_process.terminate()
+            sys.exit(200)
+        process.join()
+        hm.mergeStates(states)
+        if column_tracker is not None:
+            column_tracker.fields.update(fields)
+        n_tot_entries += n_entries
+        pprint(f'merged shard #{shard_id}: {n_entries} entries')
+    return n_tot_entries
@@ -55,6 +55,21 @@ def TH2F_category(name, title, x_categories, y_nbins, y_bin_low, y_bin_high):
         )
 
 
+def TH1F_category(name, title, x_categories=None, growth=False):
+    b_axis_name = 'X'
+    title_split = title.split(';')
+    if len(title_split) > 1:
+        b_axis_name = title_split[1]
+    b_name = title_split[0]
+    b_label = name
+    return Hist(
+        hist.axis.StrCategory(x_categories if x_categories is not None else [], name=b_axis_name, growth=growth),
+        label=b_label,
+        name=b_name,
+        storage=hist.storage.Weight()
+        )
+
+
 def fill_1Dhist(hist, array, weights=None):
     flar = ak.drop_none(ak.flatten(array))
     if weights is None:
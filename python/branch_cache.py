@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+import awkward as ak
+import numpy as np
+
+
+class BranchCache:
+    """
+    [BranchCache]: local on-disk cache of the decoded ntuple branches.
+
+    Each branch is stored per file and entry range as the buffers of the
+    awkward array (flat content and offsets) in `.npy` format, together with
+    its form. The buffers are memory-mapped when read back.
+    The cache entries are identified by a checksum of the file (built from its UUID,
+    size and the tree path), the branch name and the entry range.
+    When the total size exceeds `max_size` the least recently used entries are removed.
+
+    Args:
+    ----
+        cache_dir (string): directory where the cache is stored
+        max_size (int): max size of the cache in MB
+
+    """
+
+    def __init__(self, cache_dir, max_size=10000):
+        self.cache_dir = cache_dir
+        self.max_size = max_size*1000000
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        # entry dir -> size, ordered from the least to the most recently used
+        self.entries = OrderedDict()
+        entries = []
+        for file_key in os.listdir(cache_dir):
+            file_dir = os.path.join(cache_dir, file_key)
+            if not os.path.isdir(file_dir):
+                continue
+            for entry in os.listdir(file_dir):
+                entry_dir = os.path.join(file_dir, entry)
+                if entry.startswith('.') or not os.path.isdir(entry_dir):
+                    continue
+                entries.append((os.path.getmtime(entry_dir), entry_dir, self._dir_size(entry_dir)))
+        for _, entry_dir, size in sorted(entries):
+            self.entries[entry_dir] = size
+        self.size = sum(self.entries.values())
+        print(f'[BranchCache] cache dir: {cache_dir}, # entries: {len(self.entries)}, size: {self.size/1000000.:.1f} MB')
+
+    @staticmethod
+    def _dir_size(path):
+        return sum([os.path.getsize(os.path.join(path, file_name)) for file_name in os.listdir(path)])
+
+    @staticmethod
+    def file_key(tree):
+        checksum = hashlib.sha1(f'{tree.file.uuid}:{tree.file.fEND}:{tree.object_path}'.encode())
+        return checksum.hexdigest()
+
+    def _entry_dir(self, file_key, branch, entry_range):
+        return os.path.join(self.cache_dir, file_key, f'{branch}_{entry_range[0]}_{entry_range[1]}')
+
+    def get(self, file_key, branch, entry_range):
+        entry_dir = self._entry_dir(file_key, branch, entry_range)
+        with self.lock:
+            if entry_dir not in self.entries:
+                return None
+            self.entries.move_to_end(entry_dir)
+        try:
+            with open(os.path.join(entry_dir, 'form.json'), encoding='utf-8') as fp:
+                meta = json.load(fp)
+            container = {}
+            for key in meta['buffers']:
+                container[key] = np.load(os.path.join(entry_dir, f'{key}.npy'), mmap_mode='r')
+            os.utime(entry_dir)
+        except OSError:
+            # the entry has been removed (e.g. by another job sharing the cache)
+            with self.lock:
+                self.size -= self.entries.pop(entry_dir, 0)
+            return None
+        return ak.from_buffers(ak.forms.from_json(meta['form']), meta['length'], container)
+
+    def put(self, file_key, branch, entry_range, array):
+        entry_dir = self._entry_dir(file_key, branch, entry_range)
+        form, length, container = ak.to_buffers(ak.to_packed(array))
+        os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+        # the entry is written in a temporary dir and moved in place once complete
+        tmp_dir = tempfile.mkdtemp(prefix='.tmp', dir=os.path.dirname(entry_dir))
+        for key, buffer in container.items():
+            np.save(os.path.join(tmp_dir, f'{key}.npy'), buffer)
+        with open(os.path.join(tmp_dir, 'form.json'), 'w', encoding='utf-8') as fp:
+            json.dump({'form': form.to_json(), 'length': length, 'buffers': list(container.keys())}, fp)
+        size = self._dir_size(tmp_dir)
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # already stored (e.g. by another job sharing the cache)
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+        with self.lock:
+            self.entries[entry_dir] = size
+            self.size += size
+            self._evict()
+
+    def _evict(self):
+        while self.size > self.max_size and len(self.entries) > 1:
+            entry_dir, size = self.entries.popitem(last=False)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            self.size -= size
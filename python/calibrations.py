@@ -532,7 +532,7 @@ def rate_pt_wps_selections(wps, obj, pt_var='pt'):
                 # print(f'   rate: {rate}kHz, pt cut: {pt_cut}GeV')
                 pt_sel = selections.Selection(
                     f'@{rate}kHz', f'p_{{T}}^{{TOBJ}}>={pt_cut}GeV (@{rate}kHz)', lambda ar, pt_cut=pt_cut : ar.pt >= pt_cut)
-                obj_sel = selections.Selector(f'^{obj_sel_name}$', sm.selections)()[0]
+                obj_sel = sm.get_selection(obj_sel_name)
 
                 # print(obj_sel*pt_sel)
                 data_selections.append(obj_sel&pt_sel)
@@ -14,18 +14,21 @@ Objects:
     can be used by plotters.
 """
 
+import functools
 import math
+import operator
+import threading
+import time
 
 import awkward as ak
 import numpy as np
 import pandas as pd
 import ROOT
 import xgboost
-from scipy.spatial import cKDTree
 
 import python.calibrations as calib
 import python.clusterTools as clAlgo
-from python import classifiers, pf_regions, selections
+from python import classifiers, matching, mp_pool, pf_regions, selection_compiler, selections
 
 # import root_numpy.tmva as rnptmva
 from .utils import debugPrintOut
@@ -73,11 +76,40 @@ class EventManager:
             self.active_collections.append(collection)
 
         def read(self, event, debug):
+            # all the branches needed for a new block are read in one go
+            strides = set()
+            blocks = set()
+            for collection in self.active_collections:
+                stride = collection.read_stride(event)
+                if stride:
+                    strides.add(stride)
+                    blocks.add(collection.read_entry_block)
+            for stride in strides:
+                if debug >= 3:
+                    print(f'[EventManager] reading block of {stride} entries from entry: {event.file_entry}')
+                event.readBlock(stride)
+
             for collection in self.active_collections:
                 if debug >= 3:
                     print(f'[EventManager] filling collection: {collection.name}')
                 collection.fill(event, self.weight_file, debug)
 
+            # the next blocks are read in the background while the current one is processed
+            for block in blocks:
+                event.readAhead(block)
+
+        def set_read_entry_block(self, read_entry_block):
+            # the same block size is used for all the active collections (and hence for those depending on each other)
+            print(f'[EventManager] setting read_entry_block: {read_entry_block} for all active collections')
+            for collection in self.active_collections:
+                collection.read_entry_block = read_entry_block
+
+        def next_entry_read(self):
+            # first entry of the next block to be read by any of the active collections
+            if len(self.active_collections) == 0:
+                return None
+            return min([collection.next_entry_read for collection in self.active_collections])
+
         def get_labels(self):
             label_dict = {}
             for col in self.collections:
@@ -121,6 +153,9 @@ class DFCollection:
 
     """
 
+    # evaluate the declarative selections via numba kernels (see selection_compiler)
+    compiled_selections = False
+
     def __init__(self, name, label,
                  filler_function,
                  fixture_function=None,
@@ -148,6 +183,18 @@ class DFCollection:
 
         self.new_read = False
         self.new_read_nentries = 0
+        # selection -> mask and selection -> selected objects for the block currently read
+        self.mask_cache = {}
+        self.selection_cache = {}
+        # (selection, target collection, target selection, matching options) -> (target block, matching)
+        self.match_cache = {}
+        # the plotters can be filled concurrently: the caches are accessed holding the lock
+        # (re-entrant: the masks of composite selections are computed from those of their operands)
+        self.cache_lock = threading.RLock()
+        # compiled selections already checked against the awkward evaluation (on the first block they are used)
+        self.checked_selections = set()
+        # CutFlowHistos recording the selections evaluated (None: no cut-flow)
+        self.cutflow = None
         self.register()
 
     def register(self):
@@ -174,15 +221,17 @@ class DFCollection:
             event_manager.registerActiveCollection(self)
         return self.is_active
 
+    def read_stride(self, event):
+        """Return the # of entries to be read at this entry (None if no new read is needed)."""
+        if event.file_entry == event.file_entry_start or event.file_entry == self.next_entry_read:
+            # print ([self.read_entry_block, (event.file_entry_stop - event.file_entry)])
+            return min([self.read_entry_block, (event.file_entry_stop - event.file_entry)])
+        return None
+
     def fill(self, event, weight_file=None, debug=0):
-        stride = self.read_entry_block
         # print (f'Coll: {self.name} fill for entry: {event.file_entry}')
-        if event.file_entry == 0 or event.file_entry == self.next_entry_read or event.global_entry == event.entry_range[0]:
-            # print ([self.read_entry_block, (event.entry_range[1]-event.global_entry), (event.tree.num_entries - event.file_entry)])
-            if event.entry_range[1] != -1:
-                stride = min([self.read_entry_block, (1+event.entry_range[1]-event.global_entry), (event.tree.num_entries - event.file_entry)])
-            else:
-                stride = min([self.read_entry_block, (event.tree.num_entries - event.file_entry)])
+        stride = self.read_stride(event)
+        if stride is not None:
             # print(f'[fill] stride: {stride}')
             if stride == 0:
                 print('ERROR Last event????')
@@ -202,12 +251,84 @@ class DFCollection:
                           toPrint=self.print_function(df_print),
                           max_lines=self.max_print_lines)
 
+    def mask(self, selection):
+        """
+        Return the mask of the selection for the objects of the current block.
+
+        The composite selections are evaluated combining the masks of their operands:
+        each sub-expression (down to the primitive selections) is computed only once per block.
+        """
+        with self.cache_lock:
+            mask = self.mask_cache.get(selection, None)
+            if mask is not None:
+                return mask
+            if self.compiled_selections and selection.cuts is not None and selection not in self.checked_selections:
+                selection_compiler.check(selection, self.df)
+                self.checked_selections.add(selection)
+            start = time.perf_counter()
+            if self.compiled_selections and selection.cuts is not None:
+                # all the cuts of the (compound) selection are evaluated in a single pass
+                mask = selection_compiler.evaluate(selection.cuts, self.df)
+            if mask is None:
+                if selection.operator == 'and':
+                    mask = functools.reduce(operator.and_, [self.mask(sel) for sel in selection.operands])
+                elif selection.operator == 'or':
+                    mask = functools.reduce(operator.or_, [self.mask(sel) for sel in selection.operands])
+                else:
+                    mask = selection.selection(self.df)
+            self.mask_cache[selection] = mask
+            if self.cutflow is not None:
+                self.cutflow.fill(selection, mask, time.perf_counter() - start)
+            return mask
+
+    def select(self, selection):
+        """
+        Return the objects of the current block passing the selection.
+
+        The masks and the selected objects are cached (per selection object) until the next block is read:
+        the same selection used by several plotters is computed only once per block.
+        """
+        if selection.all:
+            return self.df
+        with self.cache_lock:
+            selected = self.selection_cache.get(selection, None)
+            if selected is None:
+                selected = self.df[self.mask(selection)]
+                self.selection_cache[selection] = selected
+            return selected
+
+    def match(self, selection, target, target_selection, **kwargs):
+        """
+        Return the matching of the objects of `target` to the objects of the current block passing the selection.
+
+        See `matching.match` for the options (DeltaR cut, policy, columns) and the format of the result.
+        The result is cached until the next block of either collection is read: the plotters matching
+        the same pair of selections share it.
+        """
+        key = (selection, target, target_selection, tuple(sorted(kwargs.items())))
+        target_df = target.df
+        with self.cache_lock:
+            cached = self.match_cache.get(key, None)
+        if cached is not None and cached[0] is target_df:
+            return cached[1]
+        # the lock is not held while selecting the target objects (which takes the lock of the target)
+        ret = matching.match(self.select(selection), target.select(target_selection), **kwargs)
+        with self.cache_lock:
+            self.match_cache[key] = (target_df, ret)
+        return ret
+
     def fill_real(self, event, stride, weight_file=None, debug=0):
+        self.mask_cache = {}
+        self.selection_cache = {}
+        self.match_cache = {}
+        start = time.perf_counter()
         self.df = self.filler_function(event, stride)
         if self.fixture_function is not None:
             self.df = self.fixture_function(self.df)
         if self.weight_function is not None:
             self.df = self.weight_function(self.df, weight_file)
+        if self.cutflow is not None:
+            self.cutflow.fill_block(self.df, time.perf_counter() - start)
         self.entries = range(1000)# FIXME: self.df.index.get_level_values('entry').unique()
         if debug > 2:
             print(f'read coll. {self.name} from entry: {event.file_entry} to entry: {event.file_entry+stride} (stride: {stride}), # rows: {len(self.df)}, # entries: {len(self.entries)}')
@@ -236,47 +357,34 @@ def tc_fixtures(tcs):
     return tcs
 
 
-def recluster_mp(cl3ds, tcs, cluster_size, cluster_function, pool):
-    # FIXME: need to be ported to uproot multiindexing
-    # cluster_sides = [x for x in [cl3ds[cl3ds.eta > 0],
-    #                              cl3ds[cl3ds.eta < 0]]]
-    # tc_sides = [x for x in [tcs[tcs.eta > 0],
-    #                         tcs[tcs.eta < 0]]]
-    #
-    # cluster_sizes = [cluster_size, cluster_size]
-    #
-    # cluster_and_tc_sides = zip(cluster_sides, tc_sides, cluster_sizes)
-    #
-    # result_3dcl = pool.map(cluster_function, cluster_and_tc_sides)
-    #
-    # # result_3dcl = []
-    # # result_3dcl.append(cluster_function(cluster_and_tc_sides[0]))
-    # # result_3dcl.append(cluster_function(cluster_and_tc_sides[1]))
-    #
-    # # print result_3dcl[0]
-    # # print result_3dcl[1]
-    #
-    merged_clusters = pd.DataFrame(columns=cl3ds.columns)
-    # for res3D in result_3dcl:
-    #     merged_clusters = merged_clusters.append(res3D, ignore_index=True, sort=False)
-    return merged_clusters
+def recluster_mp(cl3ds, tcs, cluster_size, cluster_function, pool=None):
+    # one task per endcap, run by the shared pool of workers (see mp_pool)
+    if pool is None:
+        pool = mp_pool.POOL
+    cluster_and_tc_sides = [(cl3ds[cl3ds.eta > 0], tcs[tcs.eta > 0], cluster_size),
+                            (cl3ds[cl3ds.eta < 0], tcs[tcs.eta < 0], cluster_size)]
+    result_3dcl = pool.map(cluster_function, cluster_and_tc_sides)
+    result_3dcl = [res3D for res3D in result_3dcl if not res3D.empty]
+    if len(result_3dcl) == 0:
+        return pd.DataFrame(columns=cl3ds.columns)
+    return pd.concat(result_3dcl, ignore_index=True, sort=False)
 
 
-def get_cylind_clusters_mp(cl3ds, tcs, cylind_size, pool):
+def get_cylind_clusters_mp(cl3ds, tcs, cylind_size, pool=None):
     return recluster_mp(cl3ds, tcs,
                         cluster_size=cylind_size,
                         cluster_function=clAlgo.get_cylind_clusters_unpack,
                         pool=pool)
 
 
-def get_dr_clusters_mp(cl3ds, tcs, dr_size, pool):
+def get_dr_clusters_mp(cl3ds, tcs, dr_size, pool=None):
     return recluster_mp(cl3ds, tcs,
                         cluster_size=dr_size,
                         cluster_function=clAlgo.get_dr_clusters_unpack,
                         pool=pool)
 
 
-def get_dtdu_clusters_mp(cl3ds, tcs, dr_size, pool):
+def get_dtdu_clusters_mp(cl3ds, tcs, dr_size, pool=None):
     return recluster_mp(cl3ds, tcs,
                         cluster_size=dr_size,
                         cluster_function=clAlgo.get_dtdu_clusters_unpack,
@@ -295,11 +403,16 @@ def get_emint_clusters(triggerClusters):
     return clusters_emint
 
 
-def get_merged_cl3d(triggerClusters, pool, debug=0):
-    # FIXME: need to be ported to uproot multiindexing
-    merged_clusters = pd.DataFrame(columns=triggerClusters.columns)
-    # if triggerClusters.empty:
-    #     return merged_clusters
+def get_merged_cl3d(triggerClusters, pool=None, debug=0):
+    if pool is None:
+        pool = mp_pool.POOL
+    # FIXME: filter only interesting clusters
+    clusterSides = [x for x in [triggerClusters[triggerClusters.eta > 0],
+                                triggerClusters[triggerClusters.eta < 0]] if not x.empty]
+    results3Dcl = [res3D for res3D in pool.map(clAlgo.merge3DClustersEtaPhi, clusterSides) if not res3D.empty]
+    if len(results3Dcl) == 0:
+        return pd.DataFrame(columns=triggerClusters.columns)
+    return pd.concat(results3Dcl, ignore_index=True, sort=False)
     # # FIXME: filter only interesting clusters
     # clusterSides = [x for x in [triggerClusters[triggerClusters.eta > 0],
     #                             triggerClusters[triggerClusters.eta < 0]] if not x.empty]
@@ -310,50 +423,76 @@ def get_merged_cl3d(triggerClusters, pool, debug=0):
     return merged_clusters
 
 
+# output column -> EG fields (the first one available is used)
+TRACKMATCHED_EG_COLUMNS = {
+    'pt': ('ptEm', 'pt_em'),
+    'eta': ('eta',),
+    'phi': ('phi',),
+    'quality': ('hwQual', 'quality'),
+    'bdteg': ('egbdtscore', 'bdteg'),
+    'bdt_pu': ('pubdtscore', 'bdt_pu'),
+}
+# output column -> track field
+TRACKMATCHED_TK_COLUMNS = {
+    'tkpt': 'pt',
+    'tketa': 'eta',
+    'tkphi': 'phi',
+    'tkcaloeta': 'caloeta',
+    'tkcalophi': 'calophi',
+    'tkz0': 'z0',
+    'tkchi2': 'chi2',
+    'tkchi2red': 'chi2Red',
+}
+
+# names of the EG collections for which the missing fields were reported
+_TRACKMATCHED_EG_WARNED = set()
+
+
 def get_trackmatched_egs(egs, tracks, debug=0):
-    entries = tracks.df.index.get_level_values('entry').union(egs.df.index.get_level_values('entry')).unique()
-
-    data = []
-    index = []
-    for entry in entries:
-        subentry = 0
-        kd_tree1 = cKDTree(egs.df.loc[entry][['eta', 'phi']])
-        kd_tree2 = cKDTree(tracks.df.loc[entry][['caloeta', 'calophi']])
-        sdm = kd_tree1.sparse_distance_matrix(kd_tree2, 0.2)
-        for key,dr in sdm.items():
-            eg_match = egs.df.loc[(entry, key[0])]
-            tk_match = tracks.df.loc[(entry, key[1])]
-            index.append((entry, subentry))
-            data_entry=[
-                eg_match.pt_em,
-                eg_match.eta,
-                eg_match.phi,
-                eg_match.quality,
-                eg_match.bdteg,
-                eg_match.bdt_pu,
-                tk_match.pt,
-                tk_match.eta,
-                tk_match.phi,
-                tk_match.caloeta,
-                tk_match.calophi,
-                tk_match.z0,
-                tk_match.chi2,
-                tk_match.chi2Red,
-                dr,
-                key[0],
-                key[1]]
-
-            data.append(data_entry)
-            subentry += 1
-
-    newcolumns = ['pt', 'eta', 'phi', 'quality', 'bdteg', 'bdt_pu']
-    newcolumns.extend(['tkpt', 'tketa', 'tkphi', 'tkcaloeta', 'tkcalophi', 'tkz0', 'tkchi2', 'tkchi2red', 'dr', 'clidx', 'tkidx'])
-
-    newindex = pd.MultiIndex.from_tuples(index, names=egs.df.index.names)
-    matched_egs = pd.DataFrame(data=data, columns=newcolumns, index=newindex)
+    """
+    Return the pairs of EG objects and tracks within DeltaR 0.2 for the current block of both collections.
 
+    The tracks are taken at the calorimeter surface (caloeta, calophi).
+    Each pair holds the EG fields (pt is the EM pt; the fields missing in the input are skipped, with a warning),
+    the track fields (prefixed by `tk`), their DeltaR and the indices of the EG (clidx) and of the track (tkidx)
+    in the event. To be used as filler function of a DFCollection depending on `egs` and `tracks`.
+    """
+    eg_df = egs.df
+    tk_df = tracks.df
+    # [event][eg][match] indices of the tracks
+    # the DeltaR cut is inclusive (as for the cKDTree ball query used before)
+    tk_idx = matching.match(eg_df, tk_df, deltaR=0.2, policy='all',
+                            reference_columns=('eta', 'phi', 'pt'),
+                            target_columns=('caloeta', 'calophi', 'pt'),
+                            inclusive=True)
+    eg_idx = ak.flatten(ak.broadcast_arrays(ak.local_index(eg_df, axis=1), tk_idx)[0], axis=2)
+    tk_idx = ak.flatten(tk_idx, axis=2)
+    eg_match = eg_df[eg_idx]
+    tk_match = tk_df[tk_idx]
+
+    data = {}
+    missing = []
+    for column, fields in TRACKMATCHED_EG_COLUMNS.items():
+        field = next((field for field in fields if field in eg_df.fields), None)
+        if field is not None:
+            data[column] = eg_match[field]
+        else:
+            missing.append('/'.join(fields))
+    if len(missing) > 0 and egs.name not in _TRACKMATCHED_EG_WARNED:
+        _TRACKMATCHED_EG_WARNED.add(egs.name)
+        print(f'[get_trackmatched_egs] WARNING: fields: {missing} not found in collection: {egs.name}, '
+              'the corresponding columns are skipped')
+    for column, field in TRACKMATCHED_TK_COLUMNS.items():
+        data[column] = tk_match[field]
+    data['dr'] = np.sqrt((eg_match.eta - tk_match.caloeta)**2 + matching.delta_phi(eg_match.phi, tk_match.calophi)**2)
+    data['clidx'] = eg_idx
+    data['tkidx'] = tk_idx
+    matched_egs = ak.zip(data)
+    if debug > 0:
+        print(f'[get_trackmatched_egs] # pairs: {ak.sum(ak.num(matched_egs, axis=1))}')
     return matched_egs
 
+
 def get_layer_calib_clusters(input_clusters,
                              layer_calib_factors,
                              eta_corr=(0., 0.),
@@ -403,12 +542,20 @@ def get_calibrated_clusters(calib_factors, input_3Dclusters):
     return calibrated_clusters
 
 
-def build3DClusters(name, algorithm, triggerClusters, pool, debug):
+def build3DClusters(name, algorithm, triggerClusters, pool=None, debug=0):
+    if pool is None:
+        pool = mp_pool.POOL
+    clusterSides = [x for x in [triggerClusters[triggerClusters.eta > 0],
+                                triggerClusters[triggerClusters.eta < 0]] if not x.empty]
+    results3Dcl = [res3D for res3D in pool.map(algorithm, clusterSides) if not res3D.empty]
     trigger3DClusters = pd.DataFrame()
-    # FIXME: need to be ported to uproot multiindexing
-    #
-    # if triggerClusters.empty:
-    #     return trigger3DClusters
+    if len(results3Dcl) > 0:
+        trigger3DClusters = pd.concat(results3Dcl, ignore_index=True, sort=False)
+
+    debugPrintOut(debug, name=f'{name} 3D clusters',
+                  toCount=trigger3DClusters,
+                  toPrint=trigger3DClusters.iloc[:3])
+    return trigger3DClusters
     # clusterSides = [x for x in [triggerClusters[triggerClusters.eta > 0],
     #                             triggerClusters[triggerClusters.eta < 0]] if not x.empty]
     # results3Dcl = pool.map(algorithm, clusterSides)
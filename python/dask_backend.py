@@ -0,0 +1,146 @@
+import copy
+import os
+
+import awkward as ak
+import dask
+import uproot as up
+from dask.distributed import Client, LocalCluster, as_completed
+
+import python.histos as Histos
+import python.tree_reader as treereader
+from python.analyzer import is_per_event, process_tree
+
+# analysis state inherited by the forked dask workers (see `process_dask`)
+_analysis = {}
+
+
+class ArrayBranch:
+    def __init__(self, name, uncompressed_bytes):
+        self.name = name
+        self.uncompressed_bytes = uncompressed_bytes
+
+
+class ArrayTree:
+    """
+    [ArrayTree]: tree wrapping the entries of one partition of a dask-awkward array.
+
+    Implements the subset of the uproot TTree interface used by the `TreeReader`
+    (see also `ParquetTree`) so that the collections are filled as for any other input.
+    """
+
+    def __init__(self, akarray, name):
+        self.akarray = akarray
+        self.name = name
+        self.object_path = f'/{name}'
+        self.num_entries = len(akarray)
+
+    def keys(self):
+        return self.akarray.fields
+
+    def __getitem__(self, branch):
+        return ArrayBranch(branch, self.akarray[branch].nbytes)
+
+    def arrays(self, expressions, library='ak', aliases=None, entry_start=0, entry_stop=None):
+        if library != 'ak':
+            raise ValueError(f'[ArrayTree::arrays] library: {library} not supported')
+        if aliases is None:
+            aliases = {}
+        columns = [aliases.get(expr, expr) for expr in expressions]
+        akarray = self.akarray[entry_start:entry_stop]
+        return ak.Array({expr: akarray[column] for expr, column in zip(expressions, columns)})
+
+
+def get_branches(file_name, tree_name, column_tracker=None):
+    """Return the branches to be read: the blacklisted ones are dropped and the column pruning applied."""
+    tree_file = up.open(file_name, num_workers=1)
+    branches = [br for br in tree_file[tree_name].keys() if br not in treereader.BRANCH_BLACKLIST]
+    tree_file.close()
+    if column_tracker is not None:
+        selected = set(column_tracker.select(sorted({'_'.join(br.split('_')[1:]) for br in branches})))
+        branches = [br for br in branches if '_'.join(br.split('_')[1:]) in selected]
+    return branches
+
+
+def process_partition(akarray, entry_range, max_events):
+    # runs in a forked dask worker: the plotters and histograms booked by the parent are inherited
+    params = _analysis['params']
+    hm = Histos.HistoManager()
+    # the tuples are buffered and written by the parent
+    hm.file = None
+    tree_reader = treereader.TreeReader(entry_range, max_events, _analysis['column_tracker'])
+    process_tree(params, tree_reader, ArrayTree(akarray, params.tree_name), is_per_event(params),
+                 _analysis['column_tracker'])
+    # the histograms are reused by the next partition processed by the same worker
+    states = copy.deepcopy(hm.getStates())
+    hm.resetHistos()
+    return tree_reader.n_tot_entries, states
+
+
+def process_dask(params, input_files, range_ev, max_events, column_tracker=None):
+    """
+    Run the event loop on a local dask cluster.
+
+    The input trees are split in partitions via `uproot.dask`: each partition is processed by a
+    `dask.delayed` task running the usual (eager) event loop on a forked worker, filling the histograms
+    of the plotters, and the histograms of the partitions are merged in memory by the parent.
+    Only the entries in `range_ev` (global across the input files, as for the `TreeReader`)
+    are processed, so that each batch job processes its own events.
+    Returns the # of entries processed.
+    """
+    if column_tracker is not None and column_tracker.tracing:
+        raise ValueError('[dask] column pruning mode: trace not supported by the dask backend, use: manifest')
+    if len(input_files) == 0:
+        return 0
+
+    n_workers = params.get('dask_workers', -1)
+    if n_workers < 0:
+        n_workers = len(os.sched_getaffinity(0))
+
+    branches = get_branches(input_files[0], params.tree_name, column_tracker)
+    events = up.dask({file_name: params.tree_name for file_name in input_files},
+                     filter_name=branches,
+                     step_size=params.get('dask_step_size', '100 MB'))
+    print(f'[dask] # partitions: {events.npartitions}, # branches: {len(branches)}')
+
+    tasks = []
+    first_entry, last_entry = range_ev
+    if max_events == -1 and first_entry == 0 and last_entry == -1:
+        tasks = [dask.delayed(process_partition)(partition, (0, -1), -1)
+                 for partition in events.to_delayed(optimize_graph=False)]
+    else:
+        # the # of entries per partition is needed to select the entry range and stop at max_events
+        if not events.known_divisions:
+            events.eager_compute_divisions()
+        nev_sofar = 0
+        for partition, start, stop in zip(events.to_delayed(optimize_graph=False),
+                                          events.divisions[:-1], events.divisions[1:]):
+            if max_events != -1 and nev_sofar >= max_events:
+                break
+            start_entry = max([start, first_entry])
+            stop_entry = stop if last_entry == -1 else min([stop, last_entry + 1])
+            if stop_entry <= start_entry:
+                continue
+            nev_partition = stop_entry - start_entry
+            if max_events != -1:
+                nev_partition = min([nev_partition, max_events - nev_sofar])
+            # the entry range is relative to the partition
+            tasks.append(dask.delayed(process_partition)(partition,
+                                                         (start_entry - start, stop_entry - start - 1),
+                                                         nev_partition))
+            nev_sofar += nev_partition
+
+    _analysis['params'] = params
+    _analysis['column_tracker'] = column_tracker
+    hm = Histos.HistoManager()
+    n_tot_entries = 0
+    # the workers are forked to inherit the plotters and collections (which can not be pickled)
+    with dask.config.set({'distributed.worker.multiprocessing-method': 'fork'}), \
+            LocalCluster(n_workers=n_workers, threads_per_worker=1, processes=True) as cluster, \
+            Client(cluster) as client:
+        print(f'[dask] running on {n_workers} workers, dashboard: {client.dashboard_link}')
+        for future in as_completed(client.compute(tasks)):
+            n_entries, states = future.result()
+            hm.mergeStates(states)
+            n_tot_entries += n_entries
+            future.release()
+    return n_tot_entries
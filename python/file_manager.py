@@ -389,13 +389,43 @@ def get_files_to_process(nev_toprocess, metadata, debug=0):
     return files_sofar
 
 
-def get_njobs(nev_toprocess, nev_perjob, metadata, debug=0):
-    needed_files = sorted(get_files_to_process(nev_toprocess, metadata, debug))
+def build_entry_index(metadata, file_names):
+    """
+    Build the cumulative entry index of the files.
+
+    Returns a list of (file name, global entry of the first entry in the file, # of entries)
+    """
+    index = []
     nevents_tot = 0
-    comulative = {}
-    for file_name in needed_files:
-        comulative[file_name] = nevents_tot
+    for file_name in file_names:
+        index.append((file_name, nevents_tot, int(metadata[file_name])))
         nevents_tot += int(metadata[file_name])
+    return index
+
+
+def get_files_in_range(entry_index, first_entry, last_entry):
+    """
+    Return the files with at least one entry in the global range [first_entry, last_entry].
+
+    Returns a list of (file name, local first entry, local last entry)
+    """
+    ret = []
+    for file_name, file_first_entry, nevents in entry_index:
+        if nevents == 0:
+            continue
+        file_last_entry = file_first_entry + nevents - 1
+        if file_first_entry > last_entry or file_last_entry < first_entry:
+            continue
+        ret.append((file_name,
+                    max([first_entry, file_first_entry]) - file_first_entry,
+                    min([last_entry, file_last_entry]) - file_first_entry))
+    return ret
+
+
+def get_njobs(nev_toprocess, nev_perjob, metadata, debug=0):
+    needed_files = sorted(get_files_to_process(nev_toprocess, metadata, debug))
+    entry_index = build_entry_index(metadata, needed_files)
+    nevents_tot = sum([nevents for _, _, nevents in entry_index])
 
     if debug > 3:
         print(f'Tot.# events: {nevents_tot}')
@@ -406,34 +436,23 @@ def get_njobs(nev_toprocess, nev_perjob, metadata, debug=0):
     print(f'# of jobs: {njobs}')
     ret = {}
     for job_id in range(njobs):
-        files_perjob = []
-        eventrange = (-1, -1)
-        events_injob = range(job_id * nev_perjob, (job_id + 1) * nev_perjob)
-        first_ev_injob = events_injob[0]
-        last_ev_injob = events_injob[-1]
+        first_ev_injob = job_id * nev_perjob
+        last_ev_injob = (job_id + 1) * nev_perjob - 1
         if debug > 3:
             print(f' jobid: {job_id}, i: {first_ev_injob} e: {last_ev_injob}')
-        for file_name in needed_files:
-            first_ev = comulative[file_name]
-            last_ev = first_ev + metadata[file_name]
-            if first_ev_injob >= first_ev and first_ev_injob < last_ev:
-                files_perjob.append(file_name)
-                eventrange = (first_ev_injob - first_ev, first_ev_injob - first_ev + nev_perjob - 1)
-            elif (
-                first_ev_injob < first_ev
-                and last_ev_injob >= last_ev
-                or last_ev_injob > first_ev
-                and last_ev_injob < last_ev
-            ):
-                files_perjob.append(file_name)
+        # only the files with at least one entry in the range of the job are processed:
+        # the range is expressed relative to the first entry of the first file
+        files_in_range = get_files_in_range(entry_index, first_ev_injob, last_ev_injob)
+        files_perjob = [file_name for file_name, _, _ in files_in_range]
+        eventrange = (-1, -1)
+        if len(files_in_range) > 0:
+            eventrange = (files_in_range[0][1], files_in_range[0][1] + nev_perjob - 1)
         if debug > 3:
             print(f'   files: {files_perjob}, range: {eventrange}')
-        totv = 0
-        for file_n in files_perjob:
-            if debug > 3:
+            totv = 0
+            for file_n in files_perjob:
                 print(f'    file: {file_n} ({metadata[file_n]})')
-            totv += metadata[file_n]
-        if debug > 3:
+                totv += metadata[file_n]
             print(f'   # ev in files: {totv}')
         ret[job_id] = (files_perjob, eventrange)
     return ret
@@ -1,3 +1,4 @@
+import threading
 from array import array
 
 import awkward as ak
@@ -21,6 +22,8 @@ class HistoManager:
             self.val = None
             self.histoList = list()
             self.file = None
+            # the output file is written also by the plotters filled concurrently (see BaseUpTuples)
+            self.file_lock = threading.Lock()
 
         def __str__(self):
             return f'self{self.val}'
@@ -35,6 +38,18 @@ class HistoManager:
             for histo in self.histoList:
                 histo.write(self.file)
 
+        def getStates(self):
+            return [histo.getState() for histo in self.histoList]
+
+        def mergeStates(self, states):
+            # the states need to come from the same list of histos (same booking order)
+            for histo, state in zip(self.histoList, states, strict=True):
+                histo.merge(state)
+
+        def resetHistos(self):
+            for histo in self.histoList:
+                histo.reset()
+
     instance = None
 
     def __new__(cls):
@@ -95,6 +110,27 @@ class BaseHistos:
                 up_writeable_hist = up.to_writable(writeable_hist)
                 upfile[f'{dir_name}/{writeable_hist.label}'] = up_writeable_hist
 
+    def getState(self):
+        # the histograms (w/o the graphs) to be merged by a different process
+        return {histo: getattr(self, histo) for histo in dir(self)
+                if histo.startswith('h_') and 'GraphBuilder' not in getattr(self, histo).__class__.__name__}
+
+    def merge(self, state):
+        for histo, other in state.items():
+            this = getattr(self, histo)
+            if hasattr(this, 'Add'):
+                # ROOT histograms
+                this.Add(other)
+            else:
+                this += other
+
+    def reset(self):
+        for histo in self.getState().values():
+            if hasattr(histo, 'Reset'):
+                histo.Reset()
+            else:
+                histo.reset()
+
     # def normalize(self, norm):
     #     className = self.__class__.__name__
     #     ret = className()
@@ -178,6 +214,8 @@ class BaseUpTuples(BaseHistos):
     def __init__(self, tuple_suffix, name, root_file=None, debug=False):
         self.t_name = f'{name}_{tuple_suffix}'
         self.init_ = False
+        # data buffered when no output file is available (see getState)
+        self.t_data = []
         # if not root_file:
         #     self.t_name = '{}_{}'.format(name, tuple_suffix)
         if root_file:
@@ -195,19 +233,92 @@ class BaseUpTuples(BaseHistos):
         obj_name = f'{dir_name}/{self.t_name}'
         # print( hm.file.keys())
         # print(f'OBJECT: {obj_name}')
-        if self.init_:
-            # print('extending')
-            hm.file[f'{dir_name}/{self.t_name}'].extend(data)
-        else:
-            # print('creating')
-            # hm.file.mktree(f'{dir_name}/{self.t_name}')
-            hm.file[f'{dir_name}/{self.t_name}'] = data
-            self.init_ = True
+        if hm.file is None:
+            self.t_data.append(data)
+            return
+        with hm.file_lock:
+            if self.init_:
+                # print('extending')
+                hm.file[f'{dir_name}/{self.t_name}'].extend(data)
+            else:
+                # print('creating')
+                # hm.file.mktree(f'{dir_name}/{self.t_name}')
+                hm.file[f'{dir_name}/{self.t_name}'] = data
+                self.init_ = True
+
+    def getState(self):
+        return self.t_data
+
+    def merge(self, state):
+        for data in state:
+            BaseUpTuples.fill(self, data)
+
+    def reset(self):
+        self.t_data = []
 
     def write(self, upfile):
         return
 
 
+class CutFlowHistos(BaseHistos):
+    """
+    Cut-flow of the selections evaluated on a collection.
+
+    For each selection (by name) the # of objects and of events with at least one object passing
+    and the evaluation time (in seconds, including the operands of composite selections) are accumulated.
+    The entry `all` holds the totals of the collection and the time spent filling it.
+    The histograms have one labelled bin per selection and are written under `CutFlow/`:
+    they can be merged across jobs with `hadd`.
+    """
+
+    def __init__(self, name, label='', root_file=None, debug=False):
+        if not root_file:
+            self.h_objects = bh.TH1F_category(f'{name}_objects', f'{label}: # objects passing; selection', growth=True)
+            self.h_events = bh.TH1F_category(f'{name}_events', f'{label}: # events passing; selection', growth=True)
+            self.h_time = bh.TH1F_category(f'{name}_time', f'{label}: evaluation time [s]; selection', growth=True)
+        # the selections already counted for the current block
+        self.counted = set()
+        # the masks can be computed by plotters filled concurrently
+        self.lock = threading.Lock()
+        BaseHistos.__init__(self, name, root_file, debug)
+
+    def fill_block(self, data, time):
+        with self.lock:
+            self.counted = set()
+            n_events = len(data)
+            n_objects = ak.sum(ak.num(data, axis=1)) if data.ndim > 1 else n_events
+            self.fill_counts('all', n_objects, n_events, time)
+
+    def fill(self, selection, mask, time):
+        if getattr(mask, 'ndim', 0) == 0:
+            return
+        with self.lock:
+            # the same selection (or one with the same name) is counted once per block
+            if selection.name in self.counted:
+                return
+            self.counted.add(selection.name)
+            n_objects = ak.sum(mask)
+            n_events = ak.sum(ak.any(mask, axis=1)) if mask.ndim > 1 else n_objects
+            self.fill_counts(selection.name, n_objects, n_events, time)
+
+    def fill_counts(self, name, n_objects, n_events, time):
+        self.h_objects.fill([name], weight=[n_objects])
+        self.h_events.fill([name], weight=[n_events])
+        self.h_time.fill([name], weight=[time])
+
+    def merge(self, state):
+        # the category axes can differ: the other bins are added by name
+        for histo, other in state.items():
+            this = getattr(self, histo)
+            categories = list(other.axes[0])
+            if categories:
+                this.fill(categories, weight=other.values())
+
+    def write(self, upfile):
+        for histo in [self.h_objects, self.h_events, self.h_time]:
+            upfile[f'CutFlow/{histo.label}'] = up.to_writable(histo)
+
+
 class RateHistos(BaseHistos):
     def __init__(self, name, var='pt', root_file=None, debug=False):
         if not root_file:
@@ -238,9 +349,13 @@ class RateHistos(BaseHistos):
             pt_max = ak.max(data.pt, axis=1)
         else:
             pt_max = ak.max(data[self.var], axis=1)
-        for thr,bin_center in zip(self.h_pt.axes[0].edges, self.h_pt.axes[0].centers, strict=False):
-        # for thr,bin_center in zip(self.h_pt.axes[0].edges[1:], self.h_pt.axes[0].centers):
-            self.h_pt.fill(bin_center, weight=ak.sum(pt_max>=thr))
+        # the events w/o objects do not contribute to the rate
+        pt_max = np.sort(ak.to_numpy(ak.drop_none(pt_max)))
+        axis = self.h_pt.axes[0]
+        # # of events with max p_{T} above the low edge of each bin: filled once per block with the
+        # count as weight (the variance of each bin is the sum of the squared counts of the blocks)
+        n_above = len(pt_max) - np.searchsorted(pt_max, axis.edges[:-1], side='left')
+        self.h_pt.fill(axis.centers, weight=n_above)
 
         # for ptf in range(0, int(pt)+1):
         #     self.h_pt.Fill(ptf)
@@ -269,6 +384,23 @@ class BaseTuples(BaseHistos):
                 tuple_variables)
         BaseHistos.__init__(self, name, root_file, debug)
 
+    def getState(self):
+        # the rows of the TNtuple (which can not be sent to a different process as such)
+        rows = []
+        n_vars = self.t_values.GetNvar()
+        for entry in range(self.t_values.GetEntries()):
+            self.t_values.GetEntry(entry)
+            args = self.t_values.GetArgs()
+            rows.append([args[ivar] for ivar in range(n_vars)])
+        return rows
+
+    def merge(self, state):
+        for row in state:
+            self.t_values.Fill(array('f', row))
+
+    def reset(self):
+        self.t_values.Reset()
+
     def write(self):
         if self.__class__.__name__ not in ROOT.gDirectory.GetListOfKeys():
             ROOT.gDirectory.mkdir(self.__class__.__name__)
@@ -0,0 +1,128 @@
+"""
+Match objects in (eta, phi).
+
+The matching runs in numba kernels looping over the flat content of the reference and target
+collections, event by event (via the offsets of the jagged arrays). The DeltaR cut can be given
+as DeltaR or DeltaR^2 (strict by default, optionally inclusive) and the phi difference is wrapped in [-pi, pi).
+For each reference object the policy defines the matched target objects:
+    - `pt`: the target with the highest pt within DeltaR
+    - `dpt`: the target with the smallest |pt - pt_ref| within DeltaR
+    - `all`: all the targets within DeltaR
+The indices are relative to the targets of each event.
+See also `DFCollection.match` for the matching cached per block.
+"""
+
+import awkward as ak
+import numba
+import numpy as np
+
+POLICIES = ('pt', 'dpt', 'all')
+
+
+def delta_phi(phi1, phi2):
+    """Return phi1 - phi2 in [-pi, pi) (works also on arrays)."""
+    return (phi1 - phi2 + np.pi) % (2*np.pi) - np.pi
+
+
+_delta_phi = numba.njit(nogil=True, cache=True)(delta_phi)
+
+
+@numba.njit(nogil=True, cache=True)
+def _in_dr(ref_eta, ref_phi, obj_eta, obj_phi, deltaR2, inclusive):
+    deta = obj_eta - ref_eta
+    dphi = _delta_phi(obj_phi, ref_phi)
+    dr2 = deta*deta + dphi*dphi
+    return dr2 <= deltaR2 if inclusive else dr2 < deltaR2
+
+
+@numba.njit(nogil=True, cache=True)
+def _match_best(ref_offsets, ref_eta, ref_phi, ref_pt,
+                obj_offsets, obj_eta, obj_phi, obj_pt,
+                deltaR2, inclusive, by_dpt, out):
+    for iev in range(len(ref_offsets) - 1):
+        for iref in range(ref_offsets[iev], ref_offsets[iev + 1]):
+            best = -1
+            best_score = 0.
+            for iobj in range(obj_offsets[iev], obj_offsets[iev + 1]):
+                if not _in_dr(ref_eta[iref], ref_phi[iref], obj_eta[iobj], obj_phi[iobj], deltaR2, inclusive):
+                    continue
+                score = -abs(obj_pt[iobj] - ref_pt[iref]) if by_dpt else obj_pt[iobj]
+                # the first of the best candidates is kept
+                if best == -1 or score > best_score:
+                    best = iobj - obj_offsets[iev]
+                    best_score = score
+            out[iref] = best
+
+
+@numba.njit(nogil=True, cache=True)
+def _match_all(ref_offsets, ref_eta, ref_phi,
+               obj_offsets, obj_eta, obj_phi,
+               deltaR2, inclusive, counts, out):
+    # called twice: w/o `out` to count the matches of each reference object, then to fill them
+    imatch = 0
+    for iev in range(len(ref_offsets) - 1):
+        for iref in range(ref_offsets[iev], ref_offsets[iev + 1]):
+            nmatch = 0
+            for iobj in range(obj_offsets[iev], obj_offsets[iev + 1]):
+                if _in_dr(ref_eta[iref], ref_phi[iref], obj_eta[iobj], obj_phi[iobj], deltaR2, inclusive):
+                    if out is not None:
+                        out[imatch] = iobj - obj_offsets[iev]
+                    imatch += 1
+                    nmatch += 1
+            counts[iref] = nmatch
+
+
+def _flat(array):
+    return np.ascontiguousarray(ak.to_numpy(ak.flatten(array, axis=1), allow_missing=False))
+
+
+def _offsets(array):
+    counts = ak.to_numpy(ak.num(array, axis=1))
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return counts, offsets
+
+
+def match(reference, target, deltaR=None, deltaR2=None, policy='dpt',
+          reference_columns=('eta', 'phi', 'pt'), target_columns=('eta', 'phi', 'pt'), inclusive=False):
+    """
+    Match the target objects to the reference ones (e.g. GEN particles) event by event.
+
+    Args:
+    ----
+        reference, target: jagged arrays of objects (one list per event, same # of events)
+        deltaR, deltaR2: the DeltaR (or DeltaR^2) cut: one of the two is needed
+        policy: `pt`, `dpt` or `all` (see module documentation)
+        reference_columns, target_columns: names of the (eta, phi, pt) fields
+        inclusive: the objects at exactly DeltaR are matched (DeltaR <= cut instead of < cut)
+
+    Returns:
+    -------
+        for `pt` and `dpt`: [event][reference] index of the matched target (None if there is none),
+        for `all`: [event][reference][match] indices of the matched targets.
+    """
+    if policy not in POLICIES:
+        raise ValueError(f'[matching] unknown policy: {policy}, valid: {POLICIES}')
+    if (deltaR is None) == (deltaR2 is None):
+        raise ValueError('[matching] one of deltaR and deltaR2 needs to be specified')
+    if deltaR2 is None:
+        deltaR2 = deltaR*deltaR
+
+    ref_counts, ref_offsets = _offsets(reference)
+    _, obj_offsets = _offsets(target)
+    ref_eta, ref_phi = (_flat(reference[column]) for column in reference_columns[:2])
+    obj_eta, obj_phi = (_flat(target[column]) for column in target_columns[:2])
+
+    if policy == 'all':
+        counts = np.empty(len(ref_eta), dtype=np.int64)
+        _match_all(ref_offsets, ref_eta, ref_phi, obj_offsets, obj_eta, obj_phi, deltaR2, inclusive, counts, None)
+        out = np.empty(np.sum(counts), dtype=np.int64)
+        _match_all(ref_offsets, ref_eta, ref_phi, obj_offsets, obj_eta, obj_phi, deltaR2, inclusive, counts, out)
+        return ak.unflatten(ak.unflatten(out, counts), ref_counts)
+
+    out = np.empty(len(ref_eta), dtype=np.int64)
+    _match_best(ref_offsets, ref_eta, ref_phi, _flat(reference[reference_columns[2]]),
+                obj_offsets, obj_eta, obj_phi, _flat(target[target_columns[2]]),
+                deltaR2, inclusive, policy == 'dpt', out)
+    best = ak.Array(out)
+    return ak.unflatten(ak.mask(best, best >= 0), ref_counts)
@@ -1,13 +1,58 @@
-# from multiprocessing import Pool
-# POOL = Pool(5)
+import atexit
+import os
+from concurrent import futures
+
 
-# FIXME: dummy to avoid the complication of multiprocessing for now
 class Pool:
+    """
+    [Pool]: pool of local workers shared by the modules needing to run tasks in parallel.
+
+    The workers (processes or threads) are started lazily at the first `map` call
+    which needs them. With a single worker the tasks are run serially in the
+    calling process.
+
+    Args:
+    ----
+        n_workers (int): # of workers (-1: # of cores available to the job)
+        kind (string): `process` or `thread`
+
+    """
+
+    def __init__(self, n_workers=1, kind='process'):
+        self.executor = None
+        self.configure(n_workers, kind)
+
+    def configure(self, n_workers=None, kind=None):
+        if n_workers is not None:
+            if n_workers < 0:
+                n_workers = len(os.sched_getaffinity(0))
+            self.n_workers = n_workers
+        if kind is not None:
+            if kind not in ['process', 'thread']:
+                raise ValueError(f'[Pool] unknown kind of workers: {kind}')
+            self.kind = kind
+        # the new configuration is used at the next start
+        self.shutdown()
+
+    def start(self):
+        if self.executor is None:
+            print(f'[Pool] starting {self.n_workers} {self.kind} workers')
+            if self.kind == 'process':
+                self.executor = futures.ProcessPoolExecutor(max_workers=self.n_workers)
+            else:
+                self.executor = futures.ThreadPoolExecutor(max_workers=self.n_workers)
+        return self.executor
+
     def map(self, func, args):
-        ret = []
-        for arg in args:
-            ret.append(func(args))
-        return ret
+        if self.n_workers <= 1:
+            return [func(arg) for arg in args]
+        return list(self.start().map(func, args))
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
 
 
 POOL = Pool()
+atexit.register(POOL.shutdown)
@@ -37,6 +37,9 @@ class Parameters(dict):
         table.add_row('maxEvents', str(self.maxEvents))
         table.add_row('output file', self.output_filename)
         table.add_row('events per job', str(self.events_per_job))
+        table.add_row('read workers', str(self.get('read_workers', 0)))
+        table.add_row('parallel shards', str(self.get('parallel', 0)))
+        table.add_row('backend', self.get('backend', 'uproot'))
         table.add_row('debug', str(self.debug))
         console = Console()
         console.print(table)
@@ -93,6 +96,29 @@ def get_collection_parameters(opt, cfgfile):
             if 'rate_pt_wps' in cfgfile['dataset']:
                 rate_pt_wps = cfgfile['dataset']['rate_pt_wps']
 
+            column_pruning = None
+            column_manifest = None
+            if 'column_pruning' in cfgfile['common']:
+                column_pruning = cfgfile['common']['column_pruning']
+                column_manifest = cfgfile['common'].get('column_manifest', None)
+
+            read_ahead = cfgfile['common'].get('read_ahead', 0)
+            read_ahead_max_memory = cfgfile['common'].get('read_ahead_max_memory', 2000)
+            read_block_memory = cfgfile['common'].get('read_block_memory', None)
+            branch_cache_dir = cfgfile['common'].get('branch_cache_dir', None)
+            branch_cache_max_size = cfgfile['common'].get('branch_cache_max_size', 10000)
+            read_workers = cfgfile['common'].get('read_workers', 0)
+            pool_workers = cfgfile['common'].get('pool_workers', 1)
+            pool_type = cfgfile['common'].get('pool_type', 'process')
+            fill_workers = cfgfile['common'].get('fill_workers', 0)
+            compiled_selections = cfgfile['common'].get('compiled_selections', False)
+            cutflow = cfgfile['common'].get('cutflow', False)
+            backend = cfgfile['common'].get('backend', 'uproot')
+            dask_workers = cfgfile['common'].get('dask_workers', -1)
+            dask_step_size = cfgfile['common'].get('dask_step_size', '100 MB')
+            if opt.READWORKERS is not None:
+                read_workers = opt.READWORKERS
+
             priority = 2
             if 'priorities' in collection_data and sample in collection_data['priorities']:
                 priority = collection_data['priorities'][sample]
@@ -121,6 +147,23 @@ def get_collection_parameters(opt, cfgfile):
                     'htc_jobflavor': job_flavor,
                     'htc_priority': priority,
                     'weight_file': weight_file,
+                    'column_pruning': column_pruning,
+                    'column_manifest': column_manifest,
+                    'read_ahead': read_ahead,
+                    'read_ahead_max_memory': read_ahead_max_memory,
+                    'read_block_memory': read_block_memory,
+                    'branch_cache_dir': branch_cache_dir,
+                    'branch_cache_max_size': branch_cache_max_size,
+                    'read_workers': read_workers,
+                    'pool_workers': pool_workers,
+                    'pool_type': pool_type,
+                    'parallel': opt.PARALLEL,
+                    'fill_workers': fill_workers,
+                    'compiled_selections': compiled_selections,
+                    'cutflow': cutflow,
+                    'backend': backend,
+                    'dask_workers': dask_workers,
+                    'dask_step_size': dask_step_size,
                     'debug': opt.DEBUG,
                     'name': sample,
                 }
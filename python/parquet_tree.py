@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import threading
+
+import awkward as ak
+import pyarrow.parquet as pq
+
+
+class ParquetBranch:
+    def __init__(self, name, uncompressed_bytes):
+        self.name = name
+        self.uncompressed_bytes = uncompressed_bytes
+
+
+class ParquetTree:
+    """
+    [ParquetTree]: tree stored in a Parquet file (see `convert_tree`).
+
+    Implements the subset of the uproot TTree interface used by the `TreeReader`
+    (`num_entries`, `keys`, `arrays` and access to the branch sizes) so that the
+    same reader, including the batched reads and the read-ahead, can be used.
+    Each branch is stored in a separate column: only the row groups overlapping
+    with the requested entry range are read, and only for the requested columns.
+    """
+
+    def __init__(self, file, name):
+        self.file = file
+        self.name = name
+        self.object_path = f'/{name}'
+        metadata = file.parquet.metadata
+        self.num_entries = metadata.num_rows
+        self._row_group_stops = []
+        stop = 0
+        for idx in range(metadata.num_row_groups):
+            stop += metadata.row_group(idx).num_rows
+            self._row_group_stops.append(stop)
+
+    def keys(self):
+        return self.file.parquet.schema_arrow.names
+
+    def __getitem__(self, branch):
+        metadata = self.file.parquet.metadata
+        column = self.keys().index(branch)
+        uncompressed_bytes = sum([metadata.row_group(idx).column(column).total_uncompressed_size
+                                  for idx in range(metadata.num_row_groups)])
+        return ParquetBranch(branch, uncompressed_bytes)
+
+    def arrays(self, expressions, library='ak', aliases=None, entry_start=0, entry_stop=None):
+        if library != 'ak':
+            raise ValueError(f'[ParquetTree::arrays] library: {library} not supported')
+        if aliases is None:
+            aliases = {}
+        if entry_stop is None or entry_stop > self.num_entries:
+            entry_stop = self.num_entries
+        columns = [aliases.get(expr, expr) for expr in expressions]
+
+        row_groups = []
+        first_entry = 0
+        row_group_start = 0
+        for idx, row_group_stop in enumerate(self._row_group_stops):
+            if row_group_stop > entry_start and row_group_start < entry_stop:
+                if len(row_groups) == 0:
+                    first_entry = row_group_start
+                row_groups.append(idx)
+            row_group_start = row_group_stop
+
+        with self.file.lock:
+            table = self.file.parquet.read_row_groups(row_groups, columns=columns)
+        akarray = ak.from_arrow(table)[entry_start-first_entry:entry_stop-first_entry]
+        return ak.Array({expr: akarray[column] for expr, column in zip(expressions, columns)})
+
+
+class ParquetFile:
+    """
+    [ParquetFile]: input file in Parquet format.
+
+    Behaves as the file returned by `uproot.open` as far as the analyzer is concerned:
+    the tree is accessed by name.
+    """
+
+    def __init__(self, file_name):
+        self.file_path = file_name
+        self.parquet = pq.ParquetFile(file_name)
+        self.lock = threading.Lock()
+        self.fEND = os.path.getsize(file_name)
+        metadata = self.parquet.metadata.metadata
+        self.tree_name = metadata[b'ntuple:tree_name'].decode()
+        self.uuid = metadata[b'ntuple:uuid'].decode()
+
+    def __getitem__(self, name):
+        if name != self.tree_name:
+            raise KeyError(f'[ParquetFile] file {self.file_path} contains tree: {self.tree_name} not: {name}')
+        return ParquetTree(self, name)
+
+    def close(self):
+        self.parquet.close()
+
+
+def convert_tree(tree, tree_name, output_file_name, row_group_entries=10000, branch_blacklist=None, max_events=-1):
+    """
+    Convert an uproot tree to a Parquet file with one column per branch.
+
+    The row groups contain `row_group_entries` entries: when matching the `read_entry_block` of the
+    collections each block is read from a single row group.
+    Returns the # of entries written (no file is written for an empty tree).
+    """
+    if branch_blacklist is None:
+        branch_blacklist = []
+    branches = [br for br in tree.keys() if br not in branch_blacklist]
+    entry_stop = tree.num_entries if max_events == -1 else min([max_events, tree.num_entries])
+    uuid = hashlib.sha1(f'{tree.file.uuid}:{tree.file.fEND}:{tree.object_path}'.encode()).hexdigest()
+    writer = None
+    for akarray in tree.iterate(branches, library='ak', step_size=row_group_entries, entry_stop=entry_stop):
+        table = ak.to_arrow_table(akarray)
+        if writer is None:
+            schema = table.schema.with_metadata({**table.schema.metadata,
+                                                 'ntuple:tree_name': tree_name,
+                                                 'ntuple:uuid': uuid})
+            writer = pq.ParquetWriter(output_file_name, schema)
+        writer.write_table(table.cast(writer.schema), row_group_size=row_group_entries)
+    if writer is not None:
+        writer.close()
+    return entry_stop
+
+
+def write_metadata(output_dir, file_metadata):
+    # same format of the metadata used by the file_manager: the dir does not need to be indexed again
+    with open(os.path.join(output_dir, 'metadata.json'), 'w', encoding='utf-8') as fp:
+        json.dump(file_metadata, fp)
@@ -47,6 +47,10 @@ class Test:
 
 
 class BasePlotter:
+    # set to True if `fill_histos_event` needs to be called for every event
+    # (by default it is called only at the first entry of each block)
+    per_event = False
+
     def __init__(self, data_set, data_selections, gen_set=None, gen_selections=None):
         self.data_set = data_set
         self.data_selections = data_selections
@@ -139,9 +143,7 @@ class GenericDataFramePlotter(BasePlotter):
 
     def fill_histos(self, debug=0):
         for data_sel in self.data_selections:
-            data = self.data_set.df
-            if not data_sel.all:
-                data = data[data_sel.selection(data)]
+            data = self.data_set.select(data_sel)
             self.h_set[data_sel.name].fill(data)
 
     def print(self):
@@ -504,6 +506,7 @@ class GenericGenMatchPlotter(BasePlotter):
     def plotObjectMatch(self,
                         gen,
                         objects,
+                        best_idx,
                         h_gen,
                         h_gen_matched,
                         h_object_matched,
@@ -515,34 +518,22 @@ class GenericGenMatchPlotter(BasePlotter):
         # fill histo with all selected GEN particles before any match
         h_gen.fill(gen)
 
-        # perform the matching
-        match_eta = ak.cartesian([objects.eta, gen[self.gen_eta_phi_columns[0]]])
-        match_phi = ak.cartesian([objects.phi, gen[self.gen_eta_phi_columns[1]]])
-        match_pt = ak.cartesian([objects.pt, gen.pt])
-        match_idx = ak.argcartesian([objects.eta, gen.eta])
-
-        obj_eta, gen_eta = ak.unzip(match_eta)
-        obj_phi, gen_phi = ak.unzip(match_phi)
-        obj_pt, gen_pt = ak.unzip(match_pt)
-        obj_idx, gen_idx = ak.unzip(match_idx)
-        dpt = np.abs(obj_pt - gen_pt)
-        dr2 = (obj_eta-gen_eta)**2+(obj_phi-gen_phi)**2
-        match = ak.Array(data={'ele_idx': obj_idx, 'gen_idx': gen_idx, 'dpt': dpt, 'dr2': dr2})
-        dr_match=match[match.dr2<self.dr2]
-        for genid in np.unique(ak.flatten(dr_match.gen_idx)):
-            gen_match_id = dr_match[dr_match.gen_idx == genid]
-            dpt_min_index = ak.argmin(gen_match_id.dpt, axis=1, keepdims=True)
-            best_match_id = gen_match_id[dpt_min_index]
-            matched_obj = objects[best_match_id.ele_idx]
-            matched_gen = gen[best_match_id.gen_idx]
-            h_object_matched.fill(matched_obj)
-            if h_gen_matched is not None:
-                h_gen_matched.fill(matched_gen)
-            h_reso.fill(reference=matched_gen,
-                        target=matched_obj)
-            # FIXME: [AWKWARD]
-            # if hasattr(h_reso, 'fill_nMatch'):
-            #     h_reso.fill_nMatch(len(allmatches[idx]))
+        # best_idx: index of the best L1 object (min. delta pt within dR) for each GEN particle
+        matched = ~ak.is_none(best_idx, axis=1)
+        matched_gen = gen[matched]
+        matched_obj = objects[best_idx[matched]]
+        # the matched objects are filled once per GEN slot (index of the GEN particle in the event) with
+        # any match in the block: the multiplicity histograms count the matched objects per event and GEN slot
+        gen_slot = ak.local_index(best_idx, axis=1)[matched]
+        for slot in np.unique(ak.to_numpy(ak.flatten(gen_slot))):
+            h_object_matched.fill(matched_obj[gen_slot == slot])
+        if h_gen_matched is not None:
+            h_gen_matched.fill(matched_gen)
+        h_reso.fill(reference=matched_gen,
+                    target=matched_obj)
+        # FIXME: [AWKWARD]
+        # if hasattr(h_reso, 'fill_nMatch'):
+        #     h_reso.fill_nMatch(len(allmatches[idx]))
 
 
     def book_histos(self):
@@ -560,22 +551,13 @@ class GenericGenMatchPlotter(BasePlotter):
         # FIXME: we need to reduce the # of jugged dimensions for the selection slicing to work in AWKWARD....
         # print(self.gen_set.df.fields)
         # gen = self.gen_set.df[['eta', 'abseta', 'phi', 'pt', 'energy', 'exeta', 'exphi', 'fbrem', 'gen', 'pid', 'reachedEE', 'pdgid', 'ovx', 'ovy', 'ovz']]
-        gen = self.gen_set.df
-
         for tp_sel in self.data_selections:
             # print(tp_sel)
-            if tp_sel.all:
-                # FIXME: workaround for now
-                objects = self.data_set.df
-            else:
-                objects = self.data_set.df[tp_sel.selection(self.data_set.df)]
+            # the selected objects are cached by the collections: shared by all the plotters in the block
+            objects = self.data_set.select(tp_sel)
             for gen_sel in self.gen_selections:
                 # print(gen_sel)
-                # print(gen_sel.selection(gen))
-                if gen_sel.all:
-                    genReference = gen
-                else:
-                    genReference = gen[gen_sel.selection(gen)]
+                genReference = self.gen_set.select(gen_sel)
                 histo_name = f'{self.data_set.name}_{tp_sel.name}_{gen_sel.name}'
                 # print (histo_name)
                 # print (f'# data: {objects.shape[0]}')
@@ -584,8 +566,14 @@ class GenericGenMatchPlotter(BasePlotter):
                 h_obj_match = self.h_dataset[histo_name]
                 h_resoset = self.h_resoset[histo_name]
                 h_genseleff = self.h_effset[histo_name]
+                # the matching is cached by the GEN collection: shared by all the plotters in the block
+                best_idx = self.gen_set.match(gen_sel, self.data_set, tp_sel,
+                                              deltaR2=self.dr2,
+                                              policy='dpt',
+                                              reference_columns=(*self.gen_eta_phi_columns, 'pt'))
                 self.plotObjectMatch(genReference,
                                      objects,
+                                     best_idx,
                                      h_genseleff.h_den,
                                      h_genseleff.h_num,
                                      h_obj_match,
@@ -1003,6 +991,8 @@ class ClusterTCGenMatchPlotter(BasePlotter):
 
 
 class IsoTuplePlotter(BasePlotter):
+    per_event = True
+
     def __init__(self,
                  data_set, gen_set,
                  data_selections=[selections.Selection('all')],
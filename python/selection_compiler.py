@@ -0,0 +1,141 @@
+"""
+Compile the declarative selections to numba kernels.
+
+A declarative selection is a list of (field, op, constant) cuts which are AND-ed (see `selections.Selection`).
+All the cuts of a (compound) selection are evaluated by a single kernel looping once over the flat content
+of the fields: one boolean mask is allocated and unflattened using the counts of the objects.
+The kernels depend only on the structure of the cuts (fields and operators): the constants are passed
+as arguments so that e.g. all the pt thresholds share the same compiled kernel. The constants are cast
+to the type numpy (and hence awkward) uses to compare them with the column (e.g. float32 for a float32
+column): the values at the thresholds pass or fail the cuts as for the awkward evaluation.
+See `check` for the comparison of the two evaluations.
+"""
+
+import threading
+
+import awkward as ak
+import numba
+import numpy as np
+
+from python.selections import parse_cut_field
+
+# structure of the cuts -> compiled kernel
+_kernels = {}
+_kernels_lock = threading.Lock()
+
+
+def _build_kernel(structure, n_columns):
+    args = ', '.join([f'col{idx}' for idx in range(n_columns)] + [f'c{idx}' for idx in range(len(structure))])
+    terms = []
+    for idx, (column, op, use_abs) in enumerate(structure):
+        value = f'abs(col{column}[i])' if use_abs else f'col{column}[i]'
+        terms.append(f'({value} {op} c{idx})')
+    source = (f'def kernel(out, {args}):\n'
+              f'    for i in range(out.shape[0]):\n'
+              f"        out[i] = {' and '.join(terms)}\n")
+    namespace = {}
+    exec(source, namespace)
+    return numba.njit(nogil=True)(namespace['kernel'])
+
+
+def get_kernel(structure, n_columns):
+    with _kernels_lock:
+        kernel = _kernels.get(structure, None)
+        if kernel is None:
+            kernel = _build_kernel(structure, n_columns)
+            _kernels[structure] = kernel
+    return kernel
+
+
+def evaluate(cuts, array):
+    """
+    Return the mask of the (field, op, constant) cuts for the array of objects.
+
+    Returns None if the fields can not be evaluated by a kernel (e.g. missing values or
+    more than one level of nesting): the caller needs to fall back to the awkward evaluation.
+    """
+    fields = []
+    structure = []
+    for field, op, _ in cuts:
+        name, use_abs = parse_cut_field(field)
+        if name not in fields:
+            fields.append(name)
+        structure.append((fields.index(name), op, use_abs))
+
+    jagged = array.ndim > 1
+    counts = None
+    columns = []
+    for name in fields:
+        values = array[name]
+        if jagged:
+            if counts is None:
+                counts = ak.num(values, axis=1)
+            values = ak.flatten(values, axis=1)
+        try:
+            columns.append(np.ascontiguousarray(ak.to_numpy(values, allow_missing=False)))
+        except ValueError:
+            return None
+        if columns[-1].ndim != 1:
+            return None
+
+    constants = [np.result_type(columns[column], value).type(value)
+                 for (column, _, _), (_, _, value) in zip(structure, cuts, strict=True)]
+    out = np.empty(len(columns[0]), dtype=np.bool_)
+    get_kernel(tuple(structure), len(columns))(out, *columns, *constants)
+    if jagged:
+        return ak.unflatten(out, counts)
+    return out
+
+
+def check(selection, array):
+    """
+    Compare the mask of the kernel with the one of the awkward evaluation of the selection.
+
+    Raises a ValueError if they differ (the selections which can not be compiled are not checked).
+    """
+    mask = evaluate(selection.cuts, array)
+    if mask is None:
+        return
+    if not ak.all(mask == selection.selection(array), axis=None):
+        raise ValueError(f'[selection_compiler] compiled selection: {selection.name} differs '
+                         f'from the awkward evaluation (cuts: {selection.cuts})')
+
+
+def check_selections(selections):
+    """
+    Check the compiled evaluation of the declarative selections against the awkward one (see `check`).
+
+    Each selection is evaluated on all the combinations of values of its fields: the constants of the cuts
+    and the closest values around them (also with negative sign), as float32 and as int32 fields.
+    Returns the # of selections checked.
+    """
+    n_checked = 0
+    for selection in selections:
+        if selection.cuts is None:
+            continue
+        constants = {}
+        for field, _, value in selection.cuts:
+            name, _ = parse_cut_field(field)
+            constants.setdefault(name, []).append(value)
+        for dtype in (np.float32, np.int32):
+            grids = []
+            for values in constants.values():
+                grid = np.array(values, dtype=np.float64).astype(dtype)
+                if dtype == np.float32:
+                    grid = np.concatenate([grid, np.nextafter(grid, -np.inf), np.nextafter(grid, np.inf)])
+                else:
+                    grid = np.concatenate([grid - 1, grid, grid + 1])
+                grids.append(np.unique(np.concatenate([grid, -grid])))
+            points = np.meshgrid(*grids, indexing='ij')
+            array = ak.zip({name: point.ravel() for name, point in zip(constants, points, strict=True)})
+            # both flat and jagged arrays are checked
+            check(selection, array)
+            check(selection, ak.unflatten(array, [len(array) // 2, len(array) - len(array) // 2]))
+        n_checked += 1
+    return n_checked
+
+
+if __name__ == '__main__':
+    from python.selections import SelectionManager
+    n_checked = check_selections(SelectionManager().selections)
+    print(f'[selection_compiler] {n_checked} declarative selections: compiled and awkward evaluations agree')
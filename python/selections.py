@@ -7,9 +7,12 @@ Selections can be composed (added). The actual selection syntax follows the
 `pandas` `DataFrame` `query` syntax.
 """
 
+import copy
 import json
+import operator
 import os
 import re
+import weakref
 
 import numpy as np
 
@@ -31,22 +34,60 @@ class SelectionManager:
 
     Manages the registration of selections to have a global dictionary of the labels for drawing.
 
+    The selections are interned by name: the first selection registered with a given name is the one
+    returned (e.g. to the `Selector`) and labelled, and a warning is printed if a different definition
+    (not only differing in the whitespace of the label) is registered with the same name. Only weak
+    references are kept: the intermediate selections (e.g. built by `&`) are released once not used
+    anymore, while their labels are kept in the label map.
+
     It is a singleton.
     """
 
     class __TheManager:
         def __init__(self):
-            self.selections = []
+            # name -> weak reference to the (first) selection with that name, in order of registration
+            self.registry = {}
+            # name -> label (of the selection kept in the registry, as used for drawing)
+            self.labels = {}
 
         def registerSelection(self, selection):
             # print '[EventManager] registering collection: {}'.format(collection.name)
-            self.selections.append(selection)
+            ref = self.registry.get(selection.name, None)
+            registered = ref() if ref is not None else None
+            if registered is None or registered.name != selection.name:
+                self.registry[selection.name] = weakref.ref(selection)
+                self.labels[selection.name] = selection.label
+            elif registered is not selection and not same_definition(registered, selection):
+                print(f'[SelectionManager] WARNING: selection {selection.name} redefined: '
+                      f'{registered.label_} -> {selection.label_}: the first definition is kept')
+
+        def renameSelection(self, selection, old_name):
+            ref = self.registry.get(old_name, None)
+            if ref is not None and ref() is selection:
+                # the old name is not defined anymore
+                del self.registry[old_name]
+                self.labels.pop(old_name, None)
+            self.registerSelection(selection)
+
+        def get_selection(self, name):
+            ref = self.registry.get(name, None)
+            selection = ref() if ref is not None else None
+            if selection is None:
+                raise KeyError(f'[SelectionManager] selection: {name} not registered')
+            return selection
+
+        @property
+        def selections(self):
+            # the selections still alive (a renamed selection is listed under its new name)
+            ret = []
+            for name, ref in list(self.registry.items()):
+                selection = ref()
+                if selection is not None and selection.name == name:
+                    ret.append(selection)
+            return ret
 
         def get_labels(self):
-            label_dict = {}
-            for sel in self.selections:
-                label_dict[sel.name] = sel.label
-            return label_dict
+            return self.labels
 
     instance = None
 
@@ -62,6 +103,40 @@ class SelectionManager:
         return setattr(self.instance, name)
 
 
+CUT_OPERATORS = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+
+
+def parse_cut_field(field):
+    """Return the field name and whether its absolute value is used: `abs(eta)` -> (`eta`, True)."""
+    if field.startswith('abs(') and field.endswith(')'):
+        return field[4:-1], True
+    return field, False
+
+
+def cuts_selection(cuts):
+    """Return the selection function AND-ing the (field, op, constant) cuts."""
+    for field, op, _ in cuts:
+        if op not in CUT_OPERATORS:
+            raise ValueError(f'[Selection] unknown operator: {op} in cut on: {field}')
+
+    def selection(array):
+        mask = None
+        for field, op, value in cuts:
+            name, use_abs = parse_cut_field(field)
+            values = abs(array[name]) if use_abs else array[name]
+            cut_mask = CUT_OPERATORS[op](values, value)
+            mask = cut_mask if mask is None else mask & cut_mask
+        return mask
+    return selection
+
+
 class Selection:
     """
     [Selection] class.
@@ -72,7 +147,10 @@ class Selection:
                        (should not use `-` characters or spaces)
 
         label (string): used in plot legends, no constraints
-        selection (string): see pandas.DataFrame.query syntax
+        selection (callable): function returning the mask for an array of objects.
+                              Alternatively a (field, op, constant) cut (e.g. `('abs(eta)', '<=', 1.479)`)
+                              or a list of them (AND-ed): these declarative selections can be
+                              compiled to numba kernels (see `selection_compiler`)
 
     """
 
@@ -81,10 +159,22 @@ class Selection:
         self.label_ = label
         self.selection = selection
         self.all = False
+        # the (field, op, constant) cuts of the declarative selections (None otherwise)
+        self.cuts = None
+        if isinstance(selection, tuple | list):
+            self.cuts = tuple([selection]) if isinstance(selection, tuple) else tuple(selection)
+            self.selection = cuts_selection(self.cuts)
+            selection = self.cuts
         if self.name == 'all' or selection is None:
             self.selection = lambda ar: True
             self.all = True
         self.hash = hash(selection)
+        # composite selections (built via & and |) keep track of their operands: the masks of the
+        # sub-expressions shared by several selections are computed only once per block (see DFCollection.mask)
+        self.operator = None
+        self.operands = []
+        # key of the composite selection in the table of interned selections (see `intern_selection`)
+        self.intern_key = None
         self.register()
 
     @property
@@ -112,6 +202,10 @@ class Selection:
         if other.label == '':
             new_label = self.label_
 
+        key = (new_name, 'and', self, other)
+        if key in _interned_selections:
+            return _interned_selections[key]
+
         new_selection = None
         if other.all and not self.all:
             new_selection = self.selection
@@ -120,10 +214,17 @@ class Selection:
         elif not self.all and not other.all:
             new_selection = lambda array : self.selection(array) & other.selection(array)
 
-        return Selection(
+        ret = Selection(
             name=new_name,
             label=new_label,
             selection=new_selection)
+        if not ret.all:
+            ret.operator = 'and'
+            ret.operands = [sel for sel in [self, other] if not sel.all]
+            if all(sel.cuts is not None for sel in ret.operands):
+                # the cuts of the operands can be fused in a single kernel
+                ret.cuts = tuple([cut for sel in ret.operands for cut in sel.cuts])
+        return intern_selection(key, ret)
 
 
     def __or__(self, other):
@@ -141,16 +242,46 @@ class Selection:
         # if 'GEN' in other.name or 'GEN' in self.name:
         #     obj_name = 'GEN'
         # new_label = new_label.replace('TOBJ', obj_name)
-        return Selection(
+        key = (f'{self.name}Or{other.name}', 'or', self, other)
+        if key in _interned_selections:
+            return _interned_selections[key]
+        ret = Selection(
             name=f'{self.name}Or{other.name}',
             label=new_label,
             selection=lambda array : self.selection(array) | other.selection(array))
+        ret.operator = 'or'
+        ret.operands = [self, other]
+        return intern_selection(key, ret)
 
     def rename(self, new_name, new_label = None):
+        """
+        Return the selection with the new name (and label).
+
+        The interned composite selections are shared by all the expressions building them:
+        a renamed copy is returned so that the other holders are not affected.
+        Any other selection is renamed in place.
+        """
+        if self.intern_key is not None:
+            ret = copy.copy(self)
+            # the copy is not interned: it is not returned when the same expression is built again
+            ret.intern_key = None
+            ret.operands = list(self.operands)
+            ret.name = new_name
+            if new_label:
+                ret.label_ = new_label
+            ret.register()
+            return ret
+        reindex = Selector.primitives_index.get(self.name, None) is self
+        old_name = self.name
         self.name = new_name
+        if reindex:
+            # the selectors need to match the new name
+            Selector.set_primitives(Selector.selection_primitives)
         if new_label:
             self.label_ = new_label
-        self.register()
+        selection_manager = SelectionManager()
+        selection_manager.renameSelection(self, old_name)
+        return self
 
     # def __mul__(self, other):
     #     return self.__add__(other)
@@ -166,6 +297,17 @@ class Selection:
 
 
 
+# (name, operator, operands) -> composite selection: the same composite is built (and registered) only once
+# as long as it is in use
+_interned_selections = weakref.WeakValueDictionary()
+
+
+def intern_selection(key, selection):
+    selection.intern_key = key
+    _interned_selections[key] = selection
+    return selection
+
+
 def multiply_selections(list1, list2):
     return and_selections(list1, list2)
 
@@ -184,6 +326,23 @@ def or_selections(list1, list2):
     return ret
 
 
+def same_definition(sel1, sel2):
+    # the callables can not be compared: only the labels (up to the whitespace) and the declarative cuts (if any)
+    if ''.join(sel1.label_.split()) != ''.join(sel2.label_.split()):
+        return False
+    if sel1.cuts is not None and sel2.cuts is not None:
+        return sel1.cuts == sel2.cuts
+    return True
+
+
+def index_selections(selection_list):
+    # name -> first selection with that name (in the order of the list, as `prune`)
+    ret = {}
+    for sel in selection_list:
+        ret.setdefault(sel.name, sel)
+    return ret
+
+
 def prune(selection_list):
     sel_names = set()
     ret = []
@@ -271,16 +430,30 @@ def read_iso_flateffwp_sel(file_name):
 class Selector:
     # common to all instances of the object
     selection_primitives = []
+    # index of the primitives by name (first primitive for each name) and selector -> names matched
+    primitives_index = {}
+    matches = {}
+
+    @staticmethod
+    def set_primitives(primitives):
+        Selector.selection_primitives = primitives.copy()
+        Selector.primitives_index = index_selections(primitives)
+        Selector.matches = {}
 
     def __init__(self, selector, primitives=None):
-        if primitives is None:
-            primitives = Selector.selection_primitives
         self.selections = []
         self.debug = False
-        r = re.compile(selector)
-        # mgr = SelectionManager()
-        self.selections = [sel for sel in primitives if r.match(sel.name)]
-        self.selections = prune(self.selections)
+        if primitives is None:
+            # the regex is matched once per name and the result reused by all the selectors
+            names = Selector.matches.get(selector, None)
+            if names is None:
+                r = re.compile(selector)
+                names = [name for name in Selector.primitives_index if r.match(name)]
+                Selector.matches[selector] = names
+            self.selections = [Selector.primitives_index[name] for name in names]
+        else:
+            r = re.compile(selector)
+            self.selections = prune([sel for sel in primitives if r.match(sel.name)])
         if self.debug:
             print([sel.name for sel in self.selections])
 
@@ -343,7 +516,8 @@ class Selector:
             raise ValueError
         sel = self.selections[0]
         if new_name:
-            sel.rename(new_name, new_label)
+            sel = sel.rename(new_name, new_label)
+            self.selections[0] = sel
         return sel
 
 
@@ -377,32 +551,32 @@ tp_pt_sel = [
     # Selection('Pt5to10', '5<=p_{T}^{TOBJ}<10GeV', '(pt >= 5) & (pt < 10)'),
     # Selection('Pt10to20', '10<=p_{T}^{TOBJ}<20GeV', '(pt >= 10) & (pt < 20)'),
     # Selection('Pt10', 'p_{T}^{TOBJ}>=10GeV', 'pt >= 10'),
-    Selection('Pt10', 'p_{T}^{TOBJ} #geq 10 GeV', lambda array: array.pt >= 10),
-    Selection('Pt20', 'p_{T}^{TOBJ} #geq 20 GeV', lambda array: array.pt >= 20),
-    Selection('Pt25', 'p_{T}^{TOBJ} #geq 25 GeV', lambda array: array.pt >= 25),
-    Selection('Pt30', 'p_{T}^{TOBJ} #geq 30 GeV', lambda array: array.pt >= 30)
+    Selection('Pt10', 'p_{T}^{TOBJ} #geq 10 GeV', ('pt', '>=', 10)),
+    Selection('Pt20', 'p_{T}^{TOBJ} #geq 20 GeV', ('pt', '>=', 20)),
+    Selection('Pt25', 'p_{T}^{TOBJ} #geq 25 GeV', ('pt', '>=', 25)),
+    Selection('Pt30', 'p_{T}^{TOBJ} #geq 30 GeV', ('pt', '>=', 30))
 ]
 tp_pt_sel_ext = [
-    Selection('Pt2', 'p_{T}^{TOBJ} #geq 2GeV',  lambda array: array.pt >= 2),
-    Selection('Pt3', 'p_{T}^{TOBJ} #geq 3GeV',  lambda array: array.pt >= 3),
-    Selection('Pt4', 'p_{T}^{TOBJ} #geq 4GeV',  lambda array: array.pt >= 4),
-    Selection('Pt5', 'p_{T}^{TOBJ} #geq 5GeV',  lambda array: array.pt >= 5),
-    Selection('Pt10', 'p_{T}^{TOBJ} #geq 10 GeV', lambda array: array.pt >= 10),
-    Selection('Pt15', 'p_{T}^{TOBJ} #geq 15 GeV', lambda array: array.pt >= 15),
-    Selection('Pt20', 'p_{T}^{TOBJ} #geq 20 GeV', lambda array: array.pt >= 20),
-
-    Selection('Pt23', 'p_{T}^{TOBJ} #geq 23 GeV', lambda array: array.pt >= 23),
-    Selection('Pt28', 'p_{T}^{TOBJ} #geq 28 GeV', lambda array: array.pt >= 28),
-    Selection('Pt24', 'p_{T}^{TOBJ} #geq 23 GeV', lambda array: array.pt >= 24),
-    Selection('Pt25', 'p_{T}^{TOBJ} #geq 25 GeV', lambda array: array.pt >= 25),
-    Selection('Pt30', 'p_{T}^{TOBJ} #geq 30 GeV', lambda array: array.pt >= 30),
-    Selection('Pt40', 'p_{T}^{TOBJ} #geq 40 GeV', lambda array: array.pt >= 40)
+    Selection('Pt2', 'p_{T}^{TOBJ} #geq 2GeV',  ('pt', '>=', 2)),
+    Selection('Pt3', 'p_{T}^{TOBJ} #geq 3GeV',  ('pt', '>=', 3)),
+    Selection('Pt4', 'p_{T}^{TOBJ} #geq 4GeV',  ('pt', '>=', 4)),
+    Selection('Pt5', 'p_{T}^{TOBJ} #geq 5GeV',  ('pt', '>=', 5)),
+    Selection('Pt10', 'p_{T}^{TOBJ} #geq 10 GeV', ('pt', '>=', 10)),
+    Selection('Pt15', 'p_{T}^{TOBJ} #geq 15 GeV', ('pt', '>=', 15)),
+    Selection('Pt20', 'p_{T}^{TOBJ} #geq 20 GeV', ('pt', '>=', 20)),
+
+    Selection('Pt23', 'p_{T}^{TOBJ} #geq 23 GeV', ('pt', '>=', 23)),
+    Selection('Pt28', 'p_{T}^{TOBJ} #geq 28 GeV', ('pt', '>=', 28)),
+    Selection('Pt24', 'p_{T}^{TOBJ} #geq 23 GeV', ('pt', '>=', 24)),
+    Selection('Pt25', 'p_{T}^{TOBJ} #geq 25 GeV', ('pt', '>=', 25)),
+    Selection('Pt30', 'p_{T}^{TOBJ} #geq 30 GeV', ('pt', '>=', 30)),
+    Selection('Pt40', 'p_{T}^{TOBJ} #geq 40 GeV', ('pt', '>=', 40))
 ]
 
 tp_tccluster_match_selections = [
-    Selection('Pt5to10', '5 <= p_{T}^{TOBJ} < 10GeV', lambda array: (array.pt < 10) & (array.pt >= 5)),
-    Selection('Pt10to20', '10 <= p_{T}^{TOBJ} #leq 20GeV', lambda array: (array.pt < 20) & (array.pt >= 10)),
-    Selection('Pt10to25', '10 #leq p_{T}^{TOBJ} < 25GeV', lambda array: (array.pt < 25) & (array.pt >= 10))
+    Selection('Pt5to10', '5 <= p_{T}^{TOBJ} < 10GeV', [('pt', '<', 10), ('pt', '>=', 5)]),
+    Selection('Pt10to20', '10 <= p_{T}^{TOBJ} #leq 20GeV', [('pt', '<', 20), ('pt', '>=', 10)]),
+    Selection('Pt10to25', '10 #leq p_{T}^{TOBJ} < 25GeV', [('pt', '<', 25), ('pt', '>=', 10)])
 ]
 
 tp_eta_ee_sel = [
@@ -414,8 +588,8 @@ tp_eta_ee_sel = [
     # Selection('EtaE', '|#eta^{TOBJ}| > 2.8', 'abs(eta) > 2.8'),
     # Selection('EtaAB', '|#eta^{TOBJ}| <= 1.7', 'abs(eta) <= 1.7'),
     # Selection('EtaABC', '|#eta^{TOBJ}| <= 2.4', 'abs(eta) <= 2.4'),
-    Selection('EtaBC', '1.52 < |#eta^{TOBJ}| #leq 2.4', lambda array: (abs(array.eta) > 1.52) &  (abs(array.eta) <= 2.4)),
-    Selection('EtaBCD', '1.52 < |#eta^{TOBJ}| #leq 2.8', lambda array: (abs(array.eta) > 1.52) &  (abs(array.eta) <= 2.8)),
+    Selection('EtaBC', '1.52 < |#eta^{TOBJ}| #leq 2.4', [('abs(eta)', '>', 1.52), ('abs(eta)', '<=', 2.4)]),
+    Selection('EtaBCD', '1.52 < |#eta^{TOBJ}| #leq 2.8', [('abs(eta)', '>', 1.52), ('abs(eta)', '<=', 2.8)]),
     # Selection('EtaBCDE', '1.52 < |#eta^{TOBJ}| < 3', '1.52 < abs(eta) < 3')
                      ]
 
@@ -428,22 +602,22 @@ genpart_pion_selections = [
 
 
 gen_ee_sel = [
-    Selection('Ee', '', lambda array: array.reachedEE > 0),
+    Selection('Ee', '', ('reachedEE', '>', 0)),
 ]
 
 eta_sel = [
-    Selection('EtaA', '1.49 < |#eta^{TOBJ}| #leq 1.52', lambda array: (abs(array.eta) > 1.49) & (abs(array.eta) <= 1.52)),
-    Selection('EtaB', '1.52 < |#eta^{TOBJ}| #leq 1.7', lambda array: (abs(array.eta) > 1.52) & (abs(array.eta) <= 1.7)),
-    Selection('EtaC', '1.7 < |#eta^{TOBJ}| #leq 2.4', lambda array: (abs(array.eta) > 1.7) & (abs(array.eta) <= 2.4)),
-    Selection('EtaD', '2.4 < |#eta^{TOBJ}| #leq 2.8', lambda array: (abs(array.eta) > 2.4) & (abs(array.eta) <= 2.8)),
-    Selection('EtaDE', '2.4 < |#eta^{TOBJ}| #leq 3.0', lambda array: (abs(array.eta) > 2.4) & (abs(array.eta) <= 3.0)),
-    Selection('EtaE', '|#eta^{TOBJ}| > 2.8', lambda array: abs(array.eta) > 2.8),
-    Selection('EtaAB', '1.49 < |#eta^{TOBJ}| #leq 1.7', lambda array: (abs(array.eta) > 1.49) & (abs(array.eta) <= 1.7)),
-    Selection('EtaABC', '1.49 < |#eta^{TOBJ}| #leq 2.4', lambda array: (abs(array.eta) > 1.49) & (abs(array.eta) <= 2.4)),
-    Selection('EtaABCD', '1.49 < |#eta^{TOBJ}| #leq 2.8', lambda array: (abs(array.eta) > 1.49) & (abs(array.eta) <= 2.8)),
-    Selection('EtaFABCD', '|#eta^{TOBJ}| #leq 2.8', lambda array: abs(array.eta) <= 2.8),
-    Selection('EtaFABC', '|#eta^{TOBJ}| #leq 2.4', lambda array: abs(array.eta) <= 2.4),
-    Selection('EtaBCDE', '1.52 < |#eta^{TOBJ}|', lambda array: abs(array.eta) > 1.52)
+    Selection('EtaA', '1.49 < |#eta^{TOBJ}| #leq 1.52', [('abs(eta)', '>', 1.49), ('abs(eta)', '<=', 1.52)]),
+    Selection('EtaB', '1.52 < |#eta^{TOBJ}| #leq 1.7', [('abs(eta)', '>', 1.52), ('abs(eta)', '<=', 1.7)]),
+    Selection('EtaC', '1.7 < |#eta^{TOBJ}| #leq 2.4', [('abs(eta)', '>', 1.7), ('abs(eta)', '<=', 2.4)]),
+    Selection('EtaD', '2.4 < |#eta^{TOBJ}| #leq 2.8', [('abs(eta)', '>', 2.4), ('abs(eta)', '<=', 2.8)]),
+    Selection('EtaDE', '2.4 < |#eta^{TOBJ}| #leq 3.0', [('abs(eta)', '>', 2.4), ('abs(eta)', '<=', 3.0)]),
+    Selection('EtaE', '|#eta^{TOBJ}| > 2.8', ('abs(eta)', '>', 2.8)),
+    Selection('EtaAB', '1.49 < |#eta^{TOBJ}| #leq 1.7', [('abs(eta)', '>', 1.49), ('abs(eta)', '<=', 1.7)]),
+    Selection('EtaABC', '1.49 < |#eta^{TOBJ}| #leq 2.4', [('abs(eta)', '>', 1.49), ('abs(eta)', '<=', 2.4)]),
+    Selection('EtaABCD', '1.49 < |#eta^{TOBJ}| #leq 2.8', [('abs(eta)', '>', 1.49), ('abs(eta)', '<=', 2.8)]),
+    Selection('EtaFABCD', '|#eta^{TOBJ}| #leq 2.8', ('abs(eta)', '<=', 2.8)),
+    Selection('EtaFABC', '|#eta^{TOBJ}| #leq 2.4', ('abs(eta)', '<=', 2.4)),
+    Selection('EtaBCDE', '1.52 < |#eta^{TOBJ}|', ('abs(eta)', '>', 1.52))
 ]
 
 gen_pid_sel = [
@@ -469,12 +643,12 @@ gen_part_fbrem_sel = [
 
 eg_eta_eb_sel = [
     Selection('all'),
-    Selection('EtaF', '|#eta^{TOBJ}| <= 1.479', lambda ar: abs(ar.eta) <= 1.479)
+    Selection('EtaF', '|#eta^{TOBJ}| <= 1.479', ('abs(eta)', '<=', 1.479))
     ]
 eg_eta_sel = [
     Selection('all'),
-    Selection('EtaEB', '|#eta^{TOBJ}| <= 1.479', lambda ar: abs(ar.eta) <= 1.479),
-    Selection('EtaEE', '1.479 < |#eta^{TOBJ}| <= 2.4', lambda ar: (abs(ar.eta) > 1.479) & (abs(ar.eta) <= 2.4)),
+    Selection('EtaEB', '|#eta^{TOBJ}| <= 1.479', ('abs(eta)', '<=', 1.479)),
+    Selection('EtaEE', '1.479 < |#eta^{TOBJ}| <= 2.4', [('abs(eta)', '>', 1.479), ('abs(eta)', '<=', 2.4)]),
 ]
 
 pfinput_regions = [
@@ -516,31 +690,31 @@ pf_matchedtk_input_quality = [
 
 pfeginput_pt = [
     Selection('all'),
-    Selection('Pt1', 'p_{T}^{TOBJ}#geq1GeV', lambda ar: ar.pt >= 1),
-    Selection('Pt2', 'p_{T}^{TOBJ}#geq2GeV', lambda ar: ar.pt >= 2),
-    Selection('Pt5', 'p_{T}^{TOBJ}#geq5GeV', lambda ar: ar.pt >= 5),
+    Selection('Pt1', 'p_{T}^{TOBJ}#geq1GeV', ('pt', '>=', 1)),
+    Selection('Pt2', 'p_{T}^{TOBJ}#geq2GeV', ('pt', '>=', 2)),
+    Selection('Pt5', 'p_{T}^{TOBJ}#geq5GeV', ('pt', '>=', 5)),
 ]
 
 # FIXME: these should be done using the actual online to offline threshold scaling from turn-ons
 menu_thresh_pt = [
-    Selection('PtStaEB51', 'p_{T}^{TOBJ}#geq51GeV', lambda ar: ar.pt >= 40.7),
-    Selection('PtStaEE51', 'p_{T}^{TOBJ}#geq51GeV', lambda ar: ar.pt >= 39.6),
-    Selection('PtEleEB36', 'p_{T}^{TOBJ}#geq36GeV', lambda ar: ar.pt >= 29.8),
-    Selection('PtEleEE36', 'p_{T}^{TOBJ}#geq36GeV', lambda ar: ar.pt >= 28.5),
-    Selection('PtEleEB25', 'p_{T}^{TOBJ}#geq25GeV', lambda ar: ar.pt >= 20.3),
-    Selection('PtEleEE25', 'p_{T}^{TOBJ}#geq25GeV', lambda ar: ar.pt >= 19.5),
-    Selection('PtEleEB12', 'p_{T}^{TOBJ}#geq12GeV', lambda ar: ar.pt >= 9.1),
-    Selection('PtEleEE12', 'p_{T}^{TOBJ}#geq12GeV', lambda ar: ar.pt >= 8.8),
-
-    Selection('PtIsoEleEB28', 'p_{T}^{TOBJ}#geq28GeV', lambda ar: ar.pt >= 23.),
-    Selection('PtIsoEleEE28', 'p_{T}^{TOBJ}#geq28GeV', lambda ar: ar.pt >= 22.1),
-    Selection('PtIsoPhoEB36', 'p_{T}^{TOBJ}#geq36GeV', lambda ar: ar.pt >= 30.4),
-    Selection('PtIsoPhoEE36', 'p_{T}^{TOBJ}#geq36GeV', lambda ar: ar.pt >= 29.0),
-
-    Selection('PtIsoPhoEB22', 'p_{T}^{TOBJ}#geq22GeV', lambda ar: ar.pt >= 17.6),
-    Selection('PtIsoPhoEE22', 'p_{T}^{TOBJ}#geq22GeV', lambda ar: ar.pt >= 15.9),
-    Selection('PtIsoPhoEB12', 'p_{T}^{TOBJ}#geq12GeV', lambda ar: ar.pt >= 8.5),
-    Selection('PtIsoPhoEE12', 'p_{T}^{TOBJ}#geq12GeV', lambda ar: ar.pt >= 6.),
+    Selection('PtStaEB51', 'p_{T}^{TOBJ}#geq51GeV', ('pt', '>=', 40.7)),
+    Selection('PtStaEE51', 'p_{T}^{TOBJ}#geq51GeV', ('pt', '>=', 39.6)),
+    Selection('PtEleEB36', 'p_{T}^{TOBJ}#geq36GeV', ('pt', '>=', 29.8)),
+    Selection('PtEleEE36', 'p_{T}^{TOBJ}#geq36GeV', ('pt', '>=', 28.5)),
+    Selection('PtEleEB25', 'p_{T}^{TOBJ}#geq25GeV', ('pt', '>=', 20.3)),
+    Selection('PtEleEE25', 'p_{T}^{TOBJ}#geq25GeV', ('pt', '>=', 19.5)),
+    Selection('PtEleEB12', 'p_{T}^{TOBJ}#geq12GeV', ('pt', '>=', 9.1)),
+    Selection('PtEleEE12', 'p_{T}^{TOBJ}#geq12GeV', ('pt', '>=', 8.8)),
+
+    Selection('PtIsoEleEB28', 'p_{T}^{TOBJ}#geq28GeV', ('pt', '>=', 23.)),
+    Selection('PtIsoEleEE28', 'p_{T}^{TOBJ}#geq28GeV', ('pt', '>=', 22.1)),
+    Selection('PtIsoPhoEB36', 'p_{T}^{TOBJ}#geq36GeV', ('pt', '>=', 30.4)),
+    Selection('PtIsoPhoEE36', 'p_{T}^{TOBJ}#geq36GeV', ('pt', '>=', 29.0)),
+
+    Selection('PtIsoPhoEB22', 'p_{T}^{TOBJ}#geq22GeV', ('pt', '>=', 17.6)),
+    Selection('PtIsoPhoEE22', 'p_{T}^{TOBJ}#geq22GeV', ('pt', '>=', 15.9)),
+    Selection('PtIsoPhoEB12', 'p_{T}^{TOBJ}#geq12GeV', ('pt', '>=', 8.5)),
+    Selection('PtIsoPhoEE12', 'p_{T}^{TOBJ}#geq12GeV', ('pt', '>=', 6.)),
 ]
 
 
@@ -571,20 +745,20 @@ tp_id_sel = [
     ]
 
 dz_sel = [
-    Selection('Dz1', '|#DeltaZ|<1cm', lambda array: array.dz < 1)
+    Selection('Dz1', '|#DeltaZ|<1cm', ('dz', '<', 1))
 ]
 
 
 
 comp_id_sel = [
-    Selection('IDCompWP955', 'CompID WP 0.955', lambda ar: ar.compBDTScore > -0.7318549872638138), #, epsilon_b = 0.0985
+    Selection('IDCompWP955', 'CompID WP 0.955', ('compBDTScore', '>', -0.7318549872638138)), #, epsilon_b = 0.0985
     # Selection('IDCompWP950', 'CompID WP 0.950', 'compBDTScore > -0.5871849', #, epsilon_b = 0.0917
     # Selection('IDCompWP940', 'CompID WP 0.940', 'compBDTScore > -0.4392925', #, epsilon_b = 0.0788
     # Selection('IDCompWP930', 'CompID WP 0.930', 'compBDTScore > -0.2919413', #, epsilon_b = 0.0638
     # Selection('IDCompWP920', 'CompID WP 0.920', 'compBDTScore > -0.1440416', #, epsilon_b = 0.0531
     # Selection('IDCompWP910', 'CompID WP 0.910', 'compBDTScore > 0.0825459', # epsilon_b = 0.0437
-    Selection('IDCompWP900', 'CompID WP 0.900', lambda ar: ar.compBDTScore > 0.2157780720764229), # epsilon_b = 0.0373
-    Selection('IDCompWP800', 'CompID WP 0.800', lambda ar: ar.compBDTScore > 1.694870131268548), # epsilon_b = 0.0081
+    Selection('IDCompWP900', 'CompID WP 0.900', ('compBDTScore', '>', 0.2157780720764229)), # epsilon_b = 0.0373
+    Selection('IDCompWP800', 'CompID WP 0.800', ('compBDTScore', '>', 1.694870131268548)), # epsilon_b = 0.0081
     # Selection('IDCompWP700', 'CompID WP 0.700', 'compBDTScore > 0.9914881', # epsilon_b = 0.0034
     # Selection('IDCompWP650', 'CompID WP 0.650', 'compBDTScore > 0.9954325', # epsilon_b = 0.0021
     # Selection('IDCompWP600', 'CompID WP 0.600', 'compBDTScore > 0.9958264', # epsilon_b = 0.0017
@@ -595,13 +769,13 @@ comp_id_sel = [
     ]
 
 iso_sel = [
-    Selection('Iso0p2', 'iso_{tk}<=0.2', lambda ar: ar.tkIso <= 0.2),
-    Selection('Iso0p1', 'iso_{tk}<=0.1', lambda ar: ar.tkIso <= 0.1),
-    Selection('Iso0p3', 'iso_{tk}<=0.3', lambda ar: ar.tkIso <= 0.3),
-    Selection('IsoEleEB', 'iso_{tk}<=0.13', lambda ar: ar.tkIso <= 0.13),
-    Selection('IsoEleEE', 'iso_{tk}<=0.28', lambda ar: ar.tkIso <= 0.28),
-    Selection('IsoPhoEB', 'iso_{tk}<=0.25', lambda ar: ar.tkIso <= 0.25),
-    Selection('IsoPhoEE', 'iso_{tk}<=0.205', lambda ar: ar.tkIso <= 0.205),
+    Selection('Iso0p2', 'iso_{tk}<=0.2', ('tkIso', '<=', 0.2)),
+    Selection('Iso0p1', 'iso_{tk}<=0.1', ('tkIso', '<=', 0.1)),
+    Selection('Iso0p3', 'iso_{tk}<=0.3', ('tkIso', '<=', 0.3)),
+    Selection('IsoEleEB', 'iso_{tk}<=0.13', ('tkIso', '<=', 0.13)),
+    Selection('IsoEleEE', 'iso_{tk}<=0.28', ('tkIso', '<=', 0.28)),
+    Selection('IsoPhoEB', 'iso_{tk}<=0.25', ('tkIso', '<=', 0.25)),
+    Selection('IsoPhoEE', 'iso_{tk}<=0.205', ('tkIso', '<=', 0.205)),
     # Selection('IsoEleMenu', 'iso_{tk}<=(0.13,0.28)', '((abs(eta) < 1.479) & (tkIso <= 0.13)) | ((abs(eta) > 1.479) & (tkIso <= 0.28))'),
     # Selection('IsoPhoMenu', 'iso_{tk}<=(0.25,0.205)', '((abs(eta) < 1.479) & (tkIso <= 0.25)) | ((abs(eta) > 1.479) & (tkIso <= 0.205))'),
     ]
@@ -646,7 +820,7 @@ for wps,lab in wls:
             Selection(
                 f'EgBdt{lab}{wp}', 
                 f'BDT^{{eg}}_{{{lab}}}@{wp}%', 
-                lambda x,cut=float(cut) : x.egEmIdScore > cut))
+                ('egEmIdScore', '>', float(cut))))
 
 tphgc_pubdt_sel = [
     Selection('IDPuVeto', 'PU Veto', lambda ar: ar.pfPuIdPass),
@@ -658,7 +832,7 @@ tphgc_pubdt_sel = [
 # print(tphgc_egbdt_sel)
 
 sm = SelectionManager()
-Selector.selection_primitives = sm.selections.copy()
+Selector.set_primitives(sm.selections)
 
 
 menu_sel = [
@@ -689,7 +863,7 @@ menu_sel = [
 
 ]
 # repeat the call: we want the menu selections to be avaialble via the selectors
-Selector.selection_primitives = sm.selections.copy()
+Selector.set_primitives(sm.selections)
 
 
 # tp_rate_selections = (Selector('^Em|all')*('^Eta[^DA][BC]*[BCD]$|all'))()
@@ -75,11 +75,13 @@ class TimeCounter:
         return None
 
 
+# used by the analyzer to check the time left in the batch slot
+counter = TimeCounter()
+
+
 def print_stats(func):
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        counter = TimeCounter()
-
         counter.start()
 
         nevents = 0
@@ -1,14 +1,281 @@
 import datetime
 import gc
+import json
 import resource
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import awkward as ak
+import numpy as np
 import vector
 
 vector.register_awkward()
 
+
+class MomentumRecord(ak.Record):
+    @property
+    def p4(self):
+        mass = self['mass'] if 'mass' in self.fields else 0.
+        return vector.obj(pt=self['pt'], eta=self['eta'], phi=self['phi'], mass=mass)
+
+
+class MomentumArray(ak.Array):
+    """
+    Behavior of the collections with pt, eta and phi fields (record name: NtupleMomentum).
+
+    The 4-vector (vector `Momentum4D`) is built only when needed via the `p4` property
+    (massless unless a mass or energy field is present), and the sum of two collections returns
+    the sum of the 4-vectors.
+    """
+
+    @property
+    def p4(self):
+        records = {'pt': self['pt'], 'eta': self['eta'], 'phi': self['phi']}
+        if 'mass' in self.fields:
+            records['mass'] = self['mass']
+        elif 'energy' in self.fields:
+            records['energy'] = self['energy']
+        else:
+            records['mass'] = 0.*self['pt']
+        return vector.zip(records)
+
+
+ak.behavior['NtupleMomentum'] = MomentumRecord
+ak.behavior['*', 'NtupleMomentum'] = MomentumArray
+ak.behavior[np.add, 'NtupleMomentum', 'NtupleMomentum'] = lambda left, right: left.p4 + right.p4
+
+# branches never read
+BRANCH_BLACKLIST = ['tc_wafer',
+                    'tc_cell',
+                    'tc_waferu',
+                    'tc_waferv',
+                    'tc_cellu',
+                    'tc_cellv',
+                    'gen_PUNumInt',
+                    'gen_TrueNumInt',
+                    # 'gen_daughters',
+                    'simpart_posx', 'simpart_posy', 'simpart_posz',
+                    ]
+
+class _FieldTracing:
+    """
+    Mixin recording the fields accessed on an awkward array (see ColumnTracker).
+
+    The fields pruned but accessed are read for the objects of the array via the hidden `_object` field:
+    they are listed in `fields` (while the hidden field is not).
+    """
+
+    _column_tracker = None
+    # prefix of the branches of the collection
+    _prefix = None
+
+    @property
+    def fields(self):
+        fields = [field for field in super().fields if field != '_object']
+        if '_object' in super().fields:
+            fields.extend(field for field in self._column_tracker.pruned.get(self._prefix, []) if field not in fields)
+        return fields
+
+    def __getitem__(self, where):
+        if isinstance(where, str):
+            if self._column_tracker.record(where, self):
+                return self._column_tracker.read_pruned(super().__getitem__('_object'), where)
+        elif isinstance(where, list) and all(isinstance(field, str) for field in where):
+            pruned = [field for field in where if self._column_tracker.record(field, self)]
+            if len(pruned) > 0:
+                ret = super().__getitem__([field for field in where if field not in pruned] + ['_object'])
+                for field in pruned:
+                    ret = ak.with_field(ret, self._column_tracker.read_pruned(ret['_object'], field), field)
+                return ret[where]
+        return super().__getitem__(where)
+
+    def __getattr__(self, where):
+        if not where.startswith('_') and not hasattr(type(self), where):
+            if self._column_tracker.record(where, self):
+                return self._column_tracker.read_pruned(super().__getitem__('_object'), where)
+        return super().__getattr__(where)
+
+
+class ColumnTracker:
+    """
+    [ColumnTracker]: restricts the branches read by `TreeReader.getDataFrame`.
+
+    Two modes are supported:
+        trace: the first entry block is read in full and every field accessed on the
+               resulting arrays (by fixtures, selections and histo `fill` methods) is
+               recorded. Once `freeze` is called (after the first block has been processed)
+               only the branches corresponding to the recorded fields are read.
+               The list of fields is saved to the manifest file (if any) by `save`.
+        manifest: the list of fields is read from the manifest file written by a previous
+                  `trace` run and used to restrict the reading from the first block.
+
+    The fields are recorded by name across all the collections: a branch is read if its
+    field name was accessed for any collection. The 4-vector fields are always read.
+    Fields pruned but accessed later on (via `[]` or as attributes, e.g. with an incomplete
+    manifest) are read for the objects of the current block (with a warning) and added to the
+    list: they are read with the other branches from the next block on and saved to the manifest.
+
+    Args:
+    ----
+        mode (string): `trace` or `manifest`
+        manifest (string): path of the json manifest file
+
+    """
+
+    momentum_fields = ['pt', 'eta', 'phi', 'mass', 'energy']
+    # bits of the hidden `_object` field: prefix | entry in the file | index of the object in the entry
+    source_shift = 48
+    entry_shift = 20
+
+    def __init__(self, mode, manifest=None):
+        if mode not in ['trace', 'manifest']:
+            raise ValueError(f'[ColumnTracker] unknown column pruning mode: {mode}')
+        self.mode = mode
+        self.manifest = manifest
+        self.fields = set()
+        self.tracing = mode == 'trace'
+        self.behaviors = {}
+        # reader of the current tree and prefixes of the branches of the collections (see `index`)
+        self.tree_reader = None
+        self.sources = []
+        # prefix -> fields of the branches not read
+        self.pruned = {}
+        if mode == 'manifest':
+            if manifest is None:
+                raise ValueError('[ColumnTracker] column pruning mode: manifest requires a manifest file')
+            with open(manifest, encoding='utf-8') as fp:
+                self.fields = set(json.load(fp)['fields'])
+            print(f'[ColumnTracker] read {len(self.fields)} fields from manifest: {manifest}')
+
+    def record(self, field, array):
+        """Record the access to a field: returns True if it was pruned (and needs to be read)."""
+        if self.tracing:
+            self.fields.add(field)
+            return False
+        available = ak.Array.fields.fget(array)
+        if field in available or '_object' not in available:
+            return False
+        if field not in self.pruned.get(array._prefix, []):
+            # not a branch of the collection: the usual error is raised
+            return False
+        if field not in self.fields:
+            self.fields.add(field)
+            print(f'[ColumnTracker] WARNING: field {field} was pruned but is accessed: '
+                  'it is read from now on, please update the manifest')
+            self.save()
+        return True
+
+    def read_pruned(self, objects, field):
+        """Read the pruned field for the objects (identified by the hidden `_object` field) of the current file."""
+        def read_leaf(layout, **kwargs):
+            if layout.is_numpy:
+                return ak.contents.NumpyArray(self._read_values(layout.data, field))
+            return None
+
+        # keeps the structure (jagged, nested, missing objects) of the array
+        return ak.transform(read_leaf, objects)
+
+    def _read_values(self, flat_objects, field):
+        sources = flat_objects >> self.source_shift
+        entries = (flat_objects >> self.entry_shift) & ((1 << (self.source_shift - self.entry_shift)) - 1)
+        index = flat_objects & ((1 << self.entry_shift) - 1)
+        values = np.zeros(len(flat_objects), dtype=np.float32)
+        for source in np.unique(sources):
+            # the objects can come from collections with different prefixes (e.g. merged barrel and endcap)
+            selected = sources == source
+            branch = f'{self.sources[source]}_{field}'
+            first_entry = entries[selected].min()
+            content = self.tree_reader._read_entries([branch], (first_entry, entries[selected].max() + 1))[branch]
+            if content.ndim > 1:
+                offsets = np.concatenate([[0], np.cumsum(ak.to_numpy(ak.num(content, axis=1)))])
+                content = ak.to_numpy(ak.flatten(content))
+                positions = offsets[entries[selected] - first_entry] + index[selected]
+            else:
+                content = ak.to_numpy(content)
+                positions = entries[selected] - first_entry
+            values = values.astype(np.result_type(values.dtype, content.dtype), copy=False)
+            values[selected] = content[positions]
+        return values
+
+    def select(self, names, prefix=None):
+        if self.tracing:
+            return names
+        selected = [name for name in names if name in self.fields or name in self.momentum_fields]
+        if len(selected) == 0:
+            # we need at least one branch to preserve the # of entries
+            selected = names[:1]
+        if prefix is not None:
+            self.pruned[prefix] = [name for name in names if name not in selected]
+        return selected
+
+    def trace(self, array, record_name, prefix=None):
+        key = (record_name, prefix)
+        if key not in self.behaviors:
+            base_class = ak.behavior.get(('*', record_name), ak.Array)
+            traced_class = type(f'Traced{base_class.__name__}',
+                                (_FieldTracing, base_class),
+                                {'_column_tracker': self, '_prefix': prefix})
+            self.behaviors[key] = {('*', record_name): traced_class}
+        return ak.Array(array, behavior=self.behaviors[key])
+
+    def index(self, records, tree_reader, prefix, entry_start):
+        """
+        Add the hidden `_object` field locating each object in the tree, used to read the pruned fields.
+
+        It packs the prefix of the branches (index in `sources`), the entry in the file and the index
+        of the object in the entry.
+        """
+        # the reader changes e.g. for each dask partition
+        self.tree_reader = tree_reader
+        if self.tracing or len(records) == 0:
+            return records
+        if prefix not in self.sources:
+            self.sources.append(prefix)
+        source = self.sources.index(prefix) << self.source_shift
+        first = next(iter(records.values()))
+        if first.ndim > 1:
+            counts = ak.to_numpy(ak.num(first, axis=1))
+            offsets = np.concatenate([[0], np.cumsum(counts)])
+            entries = np.repeat(np.arange(entry_start, entry_start + len(counts), dtype=np.int64), counts)
+            index = np.arange(offsets[-1]) - np.repeat(offsets[:-1], counts)
+            records['_object'] = ak.unflatten(source | (entries << self.entry_shift) | index, counts)
+        else:
+            entries = np.arange(entry_start, entry_start + len(first), dtype=np.int64)
+            records['_object'] = source | (entries << self.entry_shift)
+        return records
+
+    def freeze(self):
+        if self.tracing:
+            self.tracing = False
+            print(f'[ColumnTracker] tracing done, {len(self.fields)} fields accessed: {sorted(self.fields)}')
+
+    def save(self):
+        if self.mode != 'trace' or self.manifest is None:
+            return
+        with open(self.manifest, 'w', encoding='utf-8') as fp:
+            json.dump({'fields': sorted(self.fields)}, fp, indent=2)
+        print(f'[ColumnTracker] saved manifest: {self.manifest}')
+
+
 class TreeReader:
-    def __init__(self, entry_range, max_events):
+    """
+    [TreeReader]: reads the entries of the input trees.
+
+    Args:
+    ----
+        entry_range (tuple): global range of entries to be processed
+        max_events (int): max # of events to be processed (-1 for all)
+        column_tracker (ColumnTracker): restricts the branches actually read (optional)
+        read_ahead (int): # of entry blocks read in a background thread while
+                          the current one is processed (0 to disable)
+        read_ahead_max_memory (int): max size (in MB) of the blocks read ahead
+        branch_cache (BranchCache): local cache of the decoded branches (optional)
+
+    """
+
+    def __init__(self, entry_range, max_events, column_tracker=None, read_ahead=0, read_ahead_max_memory=2000,
+                 branch_cache=None):
         self.tree = None
         self._branches = []
         # this is the gloabl "entry" across files
@@ -19,55 +286,102 @@ class TreeReader:
         self.entry_range = entry_range
 
         self.n_tot_entries = 0
+        # debug level of the event loop (see `next`)
+        self.debug = 0
+        self.column_tracker = column_tracker
+        # prefixes (and fallbacks) requested via getDataFrame: read in one go by readBlock
+        self._prefixes = {}
+        self._block = None
+        self.read_ahead = read_ahead
+        self.read_ahead_max_memory = read_ahead_max_memory
+        self._read_ahead_queue = deque()
+        self._read_ahead_executor = None
+        if read_ahead > 0:
+            self._read_ahead_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='read_ahead')
+        self._block_nbytes = 0
+        # size (in bytes) per entry of the last block read by readBlock
+        self._entry_nbytes = 0
+        self.branch_cache = branch_cache
+        self._file_key = None
+        self.file_entry_start = 0
+        self.file_entry_stop = 0
 
     def setTree(self, uptree):
+        self.clearReadAhead()
         self.tree = uptree
+        if self.branch_cache is not None:
+            self._file_key = self.branch_cache.file_key(uptree)
         self._branches = []
-        branch_blacklist = ['tc_wafer',
-                            'tc_cell',
-                            'tc_waferu',
-                            'tc_waferv',
-                            'tc_cellu',
-                            'tc_cellv',
-                            'gen_PUNumInt',
-                            'gen_TrueNumInt',
-                            # 'gen_daughters',
-                            'simpart_posx', 'simpart_posy', 'simpart_posz',
-                            ]
         if len(self._branches) == 0:
-            self._branches = [br for br in self.tree.keys() if br not in branch_blacklist]
+            self._branches = [br for br in self.tree.keys() if br not in BRANCH_BLACKLIST]
         print(f'open new tree file with # entries: {self.tree.num_entries}')
         self.file_entry = -1
+        self._block = None
+        # range of the entries of this file to be processed: the entry_range is relative to the first file
+        first_global_entry = self.entry_range[0]
+        self.file_entry_start = self.entry_range[0]
+        if self.global_entry != -1:
+            first_global_entry = self.global_entry + 1
+            self.file_entry_start = 0
+        self.file_entry_stop = self.tree.num_entries
+        if self.entry_range[1] != -1:
+            self.file_entry_stop = min([self.file_entry_stop,
+                                        self.file_entry_start + self.entry_range[1] - first_global_entry + 1])
+
+    def finished(self):
+        """Return True if there are no more entries to be processed (in this file or in the following ones)."""
+        if self.max_events != -1 and self.n_tot_entries == self.max_events:
+            return True
+        return self.entry_range[1] != -1 and self.global_entry == self.entry_range[1]
 
     def next(self, debug=0):
+        self.debug = debug
 
         if self.max_events != -1:
             if self.n_tot_entries == self.max_events:
                 print('END loop for max_event!')
                 # we processed the max # of events
                 return False
-        if self.entry_range[1] != -1:
-            if self.global_entry == self.entry_range[1]:
+
+        next_entry = self.file_entry_start if self.file_entry == -1 else self.file_entry + 1
+        if next_entry >= self.file_entry_stop:
+            if self.file_entry_stop < self.tree.num_entries:
                 print('END loop for entry_range')
-                return False
-        if self.file_entry == self.tree.num_entries-1:
-            print('END loop for end_of_file')
+            else:
+                print('END loop for end_of_file')
             return False
 
+        # entry is the cursor in the file: when we open a new one (not the first) needs to be set to 0 again
+        self.file_entry = next_entry
         if self.global_entry == -1:
             self.global_entry = self.entry_range[0]
-            self.file_entry = self.entry_range[0]
         else:
-            self.file_entry += 1
             self.global_entry += 1
 
-        # entry is the cursor in the file: when we open a new one (not the first) needs to be set to 0 again
         if debug >= 2 or self.global_entry % 1000 == 0:
             self.printEntry()
 
         self.n_tot_entries += 1
         return True
 
+    def skipTo(self, file_entry):
+        """
+        Move the cursor so that the next call to `next` returns the given file entry.
+
+        The skipped entries are counted as processed: the max_events,
+        entry_range and end of file boundaries are respected.
+        """
+        if file_entry is None:
+            return
+        n_skip = min([file_entry, self.file_entry_stop]) - 1 - self.file_entry
+        if self.max_events != -1:
+            n_skip = min([n_skip, self.max_events - self.n_tot_entries])
+        if n_skip <= 0:
+            return
+        self.file_entry += n_skip
+        self.global_entry += n_skip
+        self.n_tot_entries += n_skip
+
     def printEntry(self):
         print(f'--- File entry: {self.file_entry}, global entry: {self.global_entry}, tot # events: {self.n_tot_entries} @ {datetime.datetime.now()}, MaxRSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1000000.0:.2f} Mb')
         # print(self.tree.keys())
@@ -89,36 +403,163 @@ class TreeReader:
             print (type(x),'\n  ', s)
 
 
-    def getDataFrame(self, prefix, entry_block, fallback=None):
+    def _get_branches(self, prefix, fallback=None):
         branches = [br for br in self._branches
                     if br.startswith(f'{prefix}_') and
                     br != f'{prefix}_n']
-        names = ['_'.join(br.split('_')[1:]) for br in branches]
-        name_map = dict(zip(names, branches))
         if len(branches) == 0:
             if fallback is not None:
-                return self.getDataFrame(prefix=fallback, entry_block=entry_block)
+                return self._get_branches(prefix=fallback)
             prefs = set([br.split('_')[0] for br in self._branches])
             print(f'stored branch prefixes are: {prefs}')
             raise ValueError(f'[TreeReader::getDataFrame] No branches with prefix: {prefix}')
+        names = ['_'.join(br.split('_')[1:]) for br in branches]
+        name_map = dict(zip(names, branches))
+        if self.column_tracker is not None:
+            names = self.column_tracker.select(names, prefix)
+            name_map = {name: name_map[name] for name in names}
+        return names, name_map
+
+    def _block_branches(self):
+        branches = []
+        for prefix, fallback in self._prefixes.items():
+            try:
+                _, name_map = self._get_branches(prefix, fallback)
+            except ValueError:
+                continue
+            branches.extend([br for br in name_map.values() if br not in branches])
+        return branches
 
-        akarray = self.tree.arrays(names,
+    def _read_tree(self, branches, entry_range):
+        start_time = time.perf_counter()
+        akarray = self.tree.arrays(branches,
                                    library='ak',
-                                   aliases=name_map,
-                                   entry_start=self.file_entry,
-                                   entry_stop=self.file_entry+entry_block)
+                                   entry_start=entry_range[0],
+                                   entry_stop=entry_range[1])
+        read_time = time.perf_counter() - start_time
+        if self.debug >= 3:
+            mbytes = akarray.nbytes/1000000.
+            print(f'[TreeReader] read entries [{entry_range[0]}, {entry_range[1]}) of {len(branches)} branches: '
+                  f'{mbytes:.1f} MB in {read_time:.2f} s ({mbytes/max([read_time, 1e-6]):.1f} MB/s)')
+        return akarray
+
+    def _read_entries(self, branches, entry_range):
+        if self.branch_cache is None:
+            return self._read_tree(branches, entry_range)
+        # the branches found in the cache are memory-mapped, the others are read and stored
+        entry_range = (entry_range[0], min([entry_range[1], self.tree.num_entries]))
+        arrays = {}
+        for br in branches:
+            arrays[br] = self.branch_cache.get(self._file_key, br, entry_range)
+        to_read = [br for br in branches if arrays[br] is None]
+        if len(to_read) > 0:
+            akarray = self._read_tree(to_read, entry_range)
+            for br in to_read:
+                arrays[br] = akarray[br]
+                self.branch_cache.put(self._file_key, br, entry_range, akarray[br])
+        return ak.Array(arrays)
+
+    def readBlock(self, entry_block):
+        """
+        Read in one go the branches of all the prefixes requested so far.
+
+        The branches for the entries [file_entry, file_entry+entry_block) are cached
+        and used by the `getDataFrame` calls for the same entry range.
+        If the block was already read ahead by the background thread that result is used.
+        """
+        self._block = None
+        if len(self._prefixes) == 0:
+            return
+        entry_range = (self.file_entry, self.file_entry+entry_block)
+        akarray = None
+        while len(self._read_ahead_queue) > 0 and self._read_ahead_queue[0][0][0] <= entry_range[0]:
+            ahead_range, future = self._read_ahead_queue.popleft()
+            if ahead_range == entry_range:
+                akarray = future.result()
+            else:
+                future.cancel()
+        if akarray is None:
+            akarray = self._read_entries(self._block_branches(), entry_range)
+        self._block_nbytes = akarray.nbytes
+        self._entry_nbytes = akarray.nbytes/(entry_range[1]-entry_range[0])
+        self._block = (entry_range, akarray)
+
+    def estimateBlockSize(self, max_memory):
+        """
+        Return the # of entries per block fitting the memory budget (in MB) for the current tree.
 
-        # print(akarray)
-        records = {}
-        for field in akarray.fields:
-            records[field] = akarray[field]
+        The size per entry is the one observed for the last block read. If no block was read yet,
+        it is estimated from the uncompressed size of the baskets of the branches requested so far
+        (or of all the branches for the first file).
+        """
+        entry_nbytes = self._entry_nbytes
+        if entry_nbytes == 0:
+            branches = self._block_branches() if len(self._prefixes) > 0 else self._branches
+            entry_nbytes = sum([self.tree[br].uncompressed_bytes for br in branches])/max([self.tree.num_entries, 1])
+        if entry_nbytes == 0:
+            return self.tree.num_entries
+        return max([int(max_memory*1000000/entry_nbytes), 1])
+
+    def readAhead(self, entry_block):
+        """
+        Schedule the reading of the next blocks of entries in the background thread.
+
+        At most `read_ahead` blocks are queued and their estimated size (based on the
+        last block read) is kept below `read_ahead_max_memory`.
+        """
+        if self._read_ahead_executor is None or len(self._prefixes) == 0:
+            return
+        if self.max_events != -1 and self.n_tot_entries - 1 + entry_block >= self.max_events:
+            # the max # of events will be reached within this block
+            return
+        branches = self._block_branches()
+        start = self.file_entry + entry_block
+        if len(self._read_ahead_queue) > 0:
+            start = self._read_ahead_queue[-1][0][1]
+        while len(self._read_ahead_queue) < self.read_ahead:
+            if (len(self._read_ahead_queue)+1)*self._block_nbytes > self.read_ahead_max_memory*1000000:
+                break
+            stop = min([start + entry_block, self.file_entry_stop])
+            if stop <= start:
+                break
+            entry_range = (start, stop)
+            self._read_ahead_queue.append(
+                (entry_range, self._read_ahead_executor.submit(self._read_entries, branches, entry_range)))
+            start = stop
+
+    def clearReadAhead(self):
+        """Drop the blocks read ahead (waiting for the reading in progress to be done)."""
+        while len(self._read_ahead_queue) > 0:
+            _, future = self._read_ahead_queue.popleft()
+            if not future.cancel():
+                future.exception()
+
+    def getDataFrame(self, prefix, entry_block, fallback=None):
+        self._prefixes[prefix] = fallback
+        names, name_map = self._get_branches(prefix, fallback)
+
+        entry_range = (self.file_entry, self.file_entry+entry_block)
+        if (self._block is not None and self._block[0] == entry_range
+                and all(br in self._block[1].fields for br in name_map.values())):
+            records = {name: self._block[1][name_map[name]] for name in names}
+        else:
+            akarray = self._read_entries(list(name_map.values()), entry_range)
+            # print(akarray)
+            records = {}
+            for name in names:
+                records[name] = akarray[name_map[name]]
 
+        record_name = None
         if 'pt' in names and 'eta' in names and 'phi' in names:
-            if 'mass' not in names and 'energy' not in names:
-                records['mass'] = 0.*akarray['pt']
-            return vector.zip(records)
+            # the 4-vector behavior is attached via the record name (see MomentumArray)
+            record_name = 'NtupleMomentum'
+        if self.column_tracker is None:
+            return ak.zip(records, with_name=record_name)
 
-        return ak.zip(records)
+        branch_prefix = name_map[names[0]][:-len(names[0])-1]
+        records = self.column_tracker.index(records, self, branch_prefix, entry_range[0])
+        return self.column_tracker.trace(ak.zip(records, with_name=record_name or 'NtupleRecord'),
+                                         record_name or 'NtupleRecord', branch_prefix)
 
         # FIXME: we should probably do an ak.Record using sometjhing along the lines of:
         # ele_rec = ak.zip({'pt': tkele.pt, 'eta': tkele.eta, 'phi': tkele.phi}, with_name="pippo")
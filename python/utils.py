@@ -16,48 +16,45 @@ def match_etaphi(ref_etaphi, trigger_etaphi, trigger_pt, deltaR=0.2, return_posi
      Returns the position of the best match (highest-pt)
        and of all the matches in the input trigger_etaphi and trigger_pt arrays.
     """
-    # print ("INPUT ref_etaphi")
-    # print (ref_etaphi)
-    # print ("INPUT trigger_etaphi")
-    # print (trigger_etaphi)
-    # print ("INPUT trigger_pt")
-    # print (trigger_pt)
-    kdtree = cKDTree(trigger_etaphi)
     best_match_indices = {}
     all_matches_indices = {}
+    if len(ref_etaphi) == 0 or len(trigger_etaphi) == 0:
+        return best_match_indices, all_matches_indices
 
-    # for iref,(eta,phi) in enumerate(ref_etaphi):
-    for index, row in ref_etaphi.iterrows():
-        gen_eta, gen_phi = row.values
-        matched = kdtree.query_ball_point([gen_eta, gen_phi], deltaR)
-        # not this in an integer of the index of the array not the index in the pandas meaning: hence to beused with iloc
-        # Handle the -pi pi transition
-        matched_sym = kdtree.query_ball_point([gen_eta, gen_phi-np.sign(gen_phi)*2.*m.pi], deltaR)
-        matched = np.unique(np.concatenate((matched, matched_sym))).astype(int)
-        # print ('matched iloc:')
-        # print (matched)
-        # print type(matched)
-        # print trigger_pt[matched]
-        # print trigger_etaphi.iloc[matched]
-        # Choose the match with highest pT
-        if (len(matched) != 0):
-            # print (trigger_pt.iloc[matched])
-            # print (trigger_pt.iloc[matched].idxmax())
-            # print (np.argmax(trigger_pt.iloc[matched]))
+    # Handle the -pi pi transition: the trigger objects are duplicated at phi -/+ 2pi
+    trigger_points = trigger_etaphi.to_numpy(dtype=float)
+    n_trigger = len(trigger_points)
+    shifts = np.array([[0., 0.], [0., 2.*m.pi], [0., -2.*m.pi]])
+    kdtree_trigger = cKDTree((trigger_points[np.newaxis, :, :] + shifts[:, np.newaxis, :]).reshape(-1, 2))
+    kdtree_ref = cKDTree(ref_etaphi.to_numpy(dtype=float))
+    # all the (reference, trigger) pairs within deltaR in one go
+    pairs = kdtree_ref.sparse_distance_matrix(kdtree_trigger, deltaR, output_type='ndarray')
+    if len(pairs) == 0:
+        return best_match_indices, all_matches_indices
+    # position of the trigger objects in the input arrays: each pair is kept once
+    matched = np.unique(np.stack([pairs['i'], pairs['j'] % n_trigger], axis=1), axis=0)
+    ref_pos, trigger_pos = matched[:, 0], matched[:, 1]
+    trigger_pt_values = trigger_pt.to_numpy()[trigger_pos]
+    # Choose the match with highest pT (the first one in case of ties): sorted by ref, -pt, position
+    order = np.lexsort((trigger_pos, -trigger_pt_values, ref_pos))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = ref_pos[order][1:] != ref_pos[order][:-1]
+    best_ref_pos = ref_pos[order][first]
+    best_trigger_pos = trigger_pos[order][first]
 
-            if return_positional:
-                best_match_indices[index] = matched[np.argmax(trigger_pt.iloc[matched])]
-                all_matches_indices[index] = matched
-            else:
-                best_match = trigger_pt.iloc[matched].idxmax()
-                best_match_indices[index] = best_match
-                all_matches_indices[index] = trigger_pt.iloc[matched].index.values
-
-            # print ('best match:')
-            # print (best_match)
-            # best_match_indices[index] = best_match
-            # all_matches_indices[index] = trigger_pt.iloc[matched].index.values
-            # print (trigger_pt.iloc[matched].index.values)
+    # the pairs are sorted by ref and trigger position
+    splits = np.flatnonzero(np.diff(ref_pos)) + 1
+    all_trigger_pos = np.split(trigger_pos, splits)
+    ref_index = ref_etaphi.index
+    trigger_index = trigger_pt.index.values
+    for iref, best, matched_pos in zip(best_ref_pos, best_trigger_pos, all_trigger_pos, strict=True):
+        index = ref_index[iref]
+        if return_positional:
+            best_match_indices[index] = best
+            all_matches_indices[index] = matched_pos
+        else:
+            best_match_indices[index] = trigger_index[best]
+            all_matches_indices[index] = trigger_index[matched_pos]
 
     # print best_match_indices
     # print all_matches_indices